@@ -1,16 +1,28 @@
 from dataclasses import dataclass
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable, AsyncIterator
+import asyncio
+import hashlib
+import time
 import httpx
 import logging
+import os
 from enum import Enum
 from contextlib import asynccontextmanager
+from cache import TTLCache, SingleFlight
+from tenant_registry import TenantRegistry
+from logging_setup import Truncated
+from resilience import HALF_OPEN, CircuitBreaker, LatencyTracker, backoff_delay, hedged
+from metrics import UPSTREAM_ERRORS, UPSTREAM_IN_FLIGHT, UPSTREAM_LATENCY
+from models import Apartment, Intercom, MediaUrls, Resident, SchemaError, TenantProfile, loads, parse_list
 
 logger = logging.getLogger(__name__)
 
+_NOT_CACHED = object()
+
 class MediaType(Enum):
     JPEG = "JPEG"
     MP4 = "MP4"
-    
+
 @dataclass
 class TenantInfo:
     tenant_id: int
@@ -19,111 +31,797 @@ class TenantInfo:
     is_super_user: bool = False
 
 @dataclass
-class DomophoneInfo:
-    id: str
-    name: str
-    tenant_id: int
+class ApiClientConfig:
+    """Настройки пула соединений с API"""
+    timeout: float = 10.0
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    tenant_cache_ttl: float = 300.0
+    tenant_cache_negative_ttl: float = 30.0
+    tenant_cache_max_entries: int = 10000
+    fanout_limit: int = 8
+    snapshot_batch_window: float = 0.005
+    snapshot_batch_max: int = 50
+    open_idempotency_window: float = 10.0
+    breaker_failure_threshold: int = 5
+    breaker_recovery_timeout: float = 30.0
+    retry_attempts: int = 2
+    retry_backoff_base: float = 0.1
+    retry_backoff_cap: float = 1.0
+    hedge_snapshots: bool = False
+    hedge_percentile: float = 0.95
+    hedge_min_delay: float = 0.05
+    hedge_min_samples: int = 20
+    # Кэш ответов GET (квартиры, домофоны квартир): свежие response_cache_ttl
+    # секунд (или max-age из ответа), затем ещё response_cache_stale_ttl
+    # секунд отдаются устаревшими с фоновой перепроверкой
+    response_cache_ttl: float = 30.0
+    response_cache_stale_ttl: float = 600.0
+    response_cache_max_entries: int = 10000
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            timeout=float(os.getenv('API_TIMEOUT', cls.timeout)),
+            max_connections=int(os.getenv('API_POOL_MAX_CONNECTIONS', cls.max_connections)),
+            max_keepalive_connections=int(os.getenv('API_POOL_MAX_KEEPALIVE', cls.max_keepalive_connections)),
+            keepalive_expiry=float(os.getenv('API_POOL_KEEPALIVE_EXPIRY', cls.keepalive_expiry)),
+            http2=os.getenv('API_HTTP2', '').lower() in ('1', 'true', 'yes'),
+            tenant_cache_ttl=float(os.getenv('TENANT_CACHE_TTL', cls.tenant_cache_ttl)),
+            tenant_cache_negative_ttl=float(os.getenv('TENANT_CACHE_NEGATIVE_TTL', cls.tenant_cache_negative_ttl)),
+            tenant_cache_max_entries=int(os.getenv('TENANT_CACHE_MAX_ENTRIES', cls.tenant_cache_max_entries)),
+            fanout_limit=int(os.getenv('API_FANOUT_LIMIT', cls.fanout_limit)),
+            snapshot_batch_window=float(os.getenv('SNAPSHOT_BATCH_WINDOW_MS', cls.snapshot_batch_window * 1000)) / 1000,
+            snapshot_batch_max=int(os.getenv('SNAPSHOT_BATCH_MAX', cls.snapshot_batch_max)),
+            open_idempotency_window=float(os.getenv('OPEN_IDEMPOTENCY_WINDOW', cls.open_idempotency_window)),
+            breaker_failure_threshold=int(os.getenv('API_BREAKER_FAILURES', cls.breaker_failure_threshold)),
+            breaker_recovery_timeout=float(os.getenv('API_BREAKER_RECOVERY', cls.breaker_recovery_timeout)),
+            retry_attempts=int(os.getenv('API_RETRY_ATTEMPTS', cls.retry_attempts)),
+            retry_backoff_base=float(os.getenv('API_RETRY_BACKOFF_BASE', cls.retry_backoff_base)),
+            retry_backoff_cap=float(os.getenv('API_RETRY_BACKOFF_CAP', cls.retry_backoff_cap)),
+            hedge_snapshots=os.getenv('API_HEDGE_SNAPSHOTS', '').lower() in ('1', 'true', 'yes'),
+            hedge_percentile=float(os.getenv('API_HEDGE_PERCENTILE', cls.hedge_percentile)),
+            hedge_min_delay=float(os.getenv('API_HEDGE_MIN_DELAY', cls.hedge_min_delay)),
+            hedge_min_samples=int(os.getenv('API_HEDGE_MIN_SAMPLES', cls.hedge_min_samples)),
+            response_cache_ttl=float(os.getenv('API_CACHE_TTL', cls.response_cache_ttl)),
+            response_cache_stale_ttl=float(os.getenv('API_CACHE_STALE_TTL', cls.response_cache_stale_ttl)),
+            response_cache_max_entries=int(os.getenv('API_CACHE_MAX_ENTRIES', cls.response_cache_max_entries))
+        )
+
+@dataclass
+class CachedResponse:
+    """Тело ответа GET с валидаторами для условного запроса"""
+    data: Any
+    digest: str
+    fresh_until: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # no-cache: устаревший ответ не отдаётся до перепроверки
+    must_revalidate: bool = False
+
+def _cache_control(response: httpx.Response) -> Dict[str, Optional[str]]:
+    """Директивы Cache-Control: имя -> значение (None, если без значения)"""
+    directives = {}
+    for directive in response.headers.get('cache-control', '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name:
+            directives[name] = value.strip('"') or None
+    return directives
+
+def _max_age(directives: Dict[str, Optional[str]]) -> Optional[float]:
+    """max-age из Cache-Control; 0 для no-cache"""
+    if 'no-cache' in directives:
+        return 0.0
+    try:
+        return float(directives['max-age'])
+    except (KeyError, TypeError, ValueError):
+        return None
 
 class ApiClientError(Exception):
     """Базовый класс для ошибок API клиента"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, detail: Any = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.detail = detail
+
+    @property
+    def detail_message(self) -> str:
+        """Текст ошибки валидации из ответа API"""
+        if isinstance(self.detail, list) and self.detail and isinstance(self.detail[0], dict):
+            return self.detail[0].get('msg', 'Неизвестная ошибка')
+        if isinstance(self.detail, str) and self.detail:
+            return self.detail
+        return 'Неизвестная ошибка'
+
+    @property
+    def is_transient(self) -> bool:
+        """Сбой на стороне API или сети, а не ошибка в запросе"""
+        return self.status_code is None or self.status_code >= 500 or self.status_code == 429
+
+class CircuitOpenError(ApiClientError):
+    """Запрос не отправлен: автомат эндпоинта открыт после серии ошибок"""
     pass
 
+class InvalidResponseError(ApiClientError):
+    """Ответ API не соответствует схеме моделей (models.py)"""
+
+    @property
+    def is_transient(self) -> bool:
+        return False
+
+class MediaLimitError(ApiClientError):
+    """Файл с сервера камер больше допустимого размера или читается дольше допустимого"""
+
+    @property
+    def is_transient(self) -> bool:
+        return False
+
+def _parse(parse: Callable[[Any], Any], data: Any, endpoint: str) -> Any:
+    """Проверка ответа на границе клиента: дальше по коду идут только модели"""
+    try:
+        return parse(data)
+    except SchemaError as e:
+        logger.error("Некорректный ответ API %s: %s", endpoint, e)
+        raise InvalidResponseError(f"Некорректный ответ API: {e}", detail=str(e))
+
+def match_media(ids: List[int], items: Tuple[MediaUrls, ...]) -> Dict[int, MediaUrls]:
+    """Сопоставление ответа urlsOnType запрошенным домофонам.
+
+    Элементы относятся к домофонам только по id: порядку ответа не
+    доверяем. Без id однозначен лишь ответ на запрос одного домофона.
+    """
+    results = {item.intercom_id: item for item in items if item.intercom_id is not None}
+    if not results and len(ids) == 1 and items:
+        results = {ids[0]: items[0]}
+    return results
+
+class SnapshotBatcher:
+    """Объединение запросов снимков в один вызов urlsOnType.
+
+    Запросы копятся window секунд отдельно для каждого tenant_id (или до
+    max_batch разных домофонов), после чего выполняется один пакетный
+    запрос, а результаты раздаются ожидающим.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[List[int], int], Awaitable[Tuple[MediaUrls, ...]]],
+        window: float = 0.005,
+        max_batch: int = 50
+    ):
+        self._fetch = fetch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[int, Dict[int, List[asyncio.Future]]] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks: set = set()
+        # Отключается, если API отвечает без id домофонов
+        self.batching = True
+        self.batches = 0
+        self.requests = 0
+
+    async def get(self, domofon_id: int, tenant_id: int) -> Optional[MediaUrls]:
+        """Ссылки на медиа одного домофона из ближайшего пакетного запроса"""
+        self.requests += 1
+        if not self.batching:
+            return match_media([domofon_id], await self._fetch([domofon_id], tenant_id)).get(domofon_id)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(tenant_id, {})
+        batch.setdefault(domofon_id, []).append(future)
+
+        if len(batch) >= self.max_batch:
+            self._flush(tenant_id)
+        elif tenant_id not in self._timers:
+            self._timers[tenant_id] = loop.call_later(self.window, self._flush, tenant_id)
+        return await future
+
+    def _flush(self, tenant_id: int):
+        timer = self._timers.pop(tenant_id, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(tenant_id, None)
+        if batch:
+            self.batches += 1
+            task = asyncio.ensure_future(self._run(tenant_id, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, tenant_id: int, batch: Dict[int, List[asyncio.Future]]):
+        ids = list(batch)
+        try:
+            items = await self._fetch(ids, tenant_id) or ()
+            if len(ids) > 1 and items and all(item.intercom_id is None for item in items):
+                # Без id элементы ответа нельзя надёжно отнести к домофонам
+                if self.batching:
+                    logger.warning("urlsOnType отвечает без id домофонов, пакетные запросы отключены")
+                self.batching = False
+                single = await asyncio.gather(*(self._fetch([domofon_id], tenant_id) for domofon_id in ids))
+                results = {}
+                for domofon_id, found in zip(ids, single):
+                    results.update(match_media([domofon_id], found))
+            else:
+                results = match_media(ids, items)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for domofon_id, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(results.get(domofon_id))
+
+
 class ApiClient:
-    def __init__(self, base_url: str, api_token: str):
+    def __init__(
+        self,
+        base_url: str,
+        api_token: str,
+        config: Optional[ApiClientConfig] = None,
+        registry: Optional[TenantRegistry] = None
+    ):
         self.base_url = base_url.rstrip('/')
+        self.config = config or ApiClientConfig()
+        self.registry = registry
         self._headers = {
             'x-api-key': api_token,
             'Content-Type': 'application/json',
             'accept': 'application/json'
         }
         self._client_config = {
-            'timeout': httpx.Timeout(10.0),
-            'limits': httpx.Limits(max_keepalive_connections=5, max_connections=10),
-            'headers': self._headers
+            'timeout': httpx.Timeout(self.config.timeout),
+            'limits': httpx.Limits(
+                max_keepalive_connections=self.config.max_keepalive_connections,
+                max_connections=self.config.max_connections,
+                keepalive_expiry=self.config.keepalive_expiry
+            ),
+            'headers': self._headers,
+            'http2': self.config.http2 and self._http2_available()
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        self.tenant_cache = TTLCache(
+            maxsize=self.config.tenant_cache_max_entries,
+            ttl=self.config.tenant_cache_ttl
+        )
+        self._tenant_flight = SingleFlight()
+        self.snapshot_batcher = SnapshotBatcher(
+            lambda ids, tenant_id: self.get_media_urls(ids, tenant_id, [MediaType.JPEG], hedge=True),
+            window=self.config.snapshot_batch_window,
+            max_batch=self.config.snapshot_batch_max
+        )
+        # Открытия двери по (tenant_id, domofon_id): идущие и недавно успешные
+        self._open_flight = SingleFlight()
+        self._recent_opens = TTLCache(maxsize=10000, ttl=self.config.open_idempotency_window)
+        self.opens_performed = 0
+        self.opens_coalesced = 0
+        self.opens_deduplicated = 0
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyTracker] = {}
+        self.hedge_stats: Dict[str, int] = {}
+        self.response_cache = TTLCache(
+            maxsize=self.config.response_cache_max_entries,
+            ttl=self.config.response_cache_ttl + self.config.response_cache_stale_ttl
+        )
+        self._response_flight = SingleFlight()
+        self._revalidations: set = set()
+        self.response_stats = {'fresh': 0, 'stale': 0, 'not_modified': 0, 'fetched': 0}
+
+    @staticmethod
+    def _http2_available() -> bool:
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            logger.warning("HTTP/2 запрошен, но пакет h2 не установлен - используется HTTP/1.1")
+            return False
+
+    async def start(self):
+        """Открытие общего пула соединений"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(**self._client_config)
+            logger.info(
+                "Пул соединений с API открыт: max_connections=%s, keepalive=%s, http2=%s",
+                self.config.max_connections, self.config.max_keepalive_connections, self._client_config['http2']
+            )
+
+    async def close(self):
+        """Закрытие общего пула соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Пул соединений с API закрыт")
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
 
     @asynccontextmanager
     async def _make_request(self):
-        """Контекстный менеджер для выполнения HTTP-запросов"""
-        async with httpx.AsyncClient(**self._client_config) as client:
-            yield client
+        """Контекстный менеджер, выдающий общий HTTP-клиент"""
+        if self._client is None or self._client.is_closed:
+            await self.start()
+        yield self._client
 
-    async def _handle_response(self, response: httpx.Response) -> Dict[str, Any]:
+    async def _handle_response(self, response: httpx.Response) -> Any:
         """Обработка ответа от API"""
         try:
             response.raise_for_status()
-            return response.json()
+            return loads(response.content)
         except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP ошибка: {e.response.status_code} - {e.response.text}")
-            raise ApiClientError(f"HTTP ошибка: {e.response.status_code}")
+            logger.error("HTTP ошибка: %s - %s", e.response.status_code, Truncated(e.response.text))
+            try:
+                detail = e.response.json().get('detail')
+            except Exception:
+                detail = e.response.text
+            raise ApiClientError(
+                f"HTTP ошибка: {e.response.status_code}",
+                status_code=e.response.status_code,
+                detail=detail
+            )
         except Exception as e:
-            logger.error(f"Неожиданная ошибка: {str(e)}")
+            logger.error("Неожиданная ошибка: %s", e)
             raise ApiClientError(f"Неожиданная ошибка: {str(e)}")
 
-    async def check_tenant(self, tenant_id: int) -> Optional[TenantInfo]:
-        """Получение информации о пользователе"""
-        phone_mapping = {
-            22063: 79002288610,
-            22064: 79156562250,
-            22065: 79205451794
+    def _breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers[endpoint] = CircuitBreaker(
+                endpoint,
+                failure_threshold=self.config.breaker_failure_threshold,
+                recovery_timeout=self.config.breaker_recovery_timeout
+            )
+        return breaker
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        endpoint: str,
+        retry: bool = False,
+        hedge: bool = False,
+        raw: bool = False,
+        **kwargs
+    ) -> Any:
+        """Выполнение запроса через общий пул соединений.
+
+        endpoint - имя эндпоинта для автомата и статистики; retry - повторять
+        при сбоях (только для идемпотентных запросов); hedge - дублировать
+        медленный запрос (при включённом API_HEDGE_SNAPSHOTS); raw - вернуть
+        httpx.Response успешного ответа без разбора JSON.
+        """
+        breaker = self._breaker(endpoint)
+        if not breaker.allow_request():
+            UPSTREAM_ERRORS.labels(endpoint, 'circuit_open').inc()
+            raise CircuitOpenError(f"API {endpoint} временно недоступен")
+
+        probe = breaker.state == HALF_OPEN
+        attempts = 1 + (self.config.retry_attempts if retry else 0)
+        try:
+            for attempt in range(attempts):
+                try:
+                    if hedge and self.config.hedge_snapshots:
+                        result = await self._hedged_send(method, path, endpoint, kwargs)
+                    else:
+                        result = await self._send(method, path, endpoint, kwargs, raw)
+                except ApiClientError as e:
+                    if not e.is_transient:
+                        # API ответил, просто запрос некорректен
+                        breaker.record_success()
+                        raise
+                    breaker.record_failure()
+                    if attempt == attempts - 1 or not breaker.allow_request():
+                        raise
+                    await asyncio.sleep(backoff_delay(attempt, self.config.retry_backoff_base, self.config.retry_backoff_cap))
+                    continue
+                breaker.record_success()
+                return result
+        finally:
+            if probe:
+                # Отменённый пробный запрос иначе навсегда занял бы слот half-open
+                breaker.release_probe()
+
+    async def _send(self, method: str, path: str, endpoint: str, kwargs: Dict[str, Any], raw: bool = False) -> Any:
+        started = time.monotonic()
+        try:
+            with UPSTREAM_IN_FLIGHT.track(endpoint):
+                async with self._make_request() as client:
+                    response = await client.request(method, f"{self.base_url}{path}", **kwargs)
+        except httpx.RequestError as e:
+            logger.error("Ошибка соединения с API: %s", e)
+            UPSTREAM_ERRORS.labels(endpoint, type(e).__name__).inc()
+            raise ApiClientError(f"Ошибка соединения: {str(e)}")
+        elapsed = time.monotonic() - started
+        self._latency.setdefault(endpoint, LatencyTracker()).record(elapsed)
+        UPSTREAM_LATENCY.labels(endpoint).observe(elapsed)
+        if response.status_code >= 400:
+            UPSTREAM_ERRORS.labels(endpoint, response.status_code).inc()
+        elif raw:
+            return response
+        return await self._handle_response(response)
+
+    async def _hedged_send(self, method: str, path: str, endpoint: str, kwargs: Dict[str, Any]) -> Any:
+        """Дублирующий запрос, если первый дольше заданного перцентиля задержек"""
+        tracker = self._latency.get(endpoint)
+        if tracker is None or len(tracker) < self.config.hedge_min_samples:
+            return await self._send(method, path, endpoint, kwargs)
+        delay = max(self.config.hedge_min_delay, tracker.percentile(self.config.hedge_percentile))
+        return await hedged(lambda: self._send(method, path, endpoint, kwargs), delay, self.hedge_stats)
+
+    def resilience_stats(self) -> Dict[str, Any]:
+        """Состояние автоматов и статистика дублирующих запросов"""
+        return {
+            'breakers': {
+                name: {'state': b.state, 'failures': b.failures, 'rejected': b.rejected}
+                for name, b in self._breakers.items()
+            },
+            'hedge': dict(self.hedge_stats)
         }
-        chat_id_mapping = {
-            22063: "1061531514",
-            22064: "901275122",
-            22065: "5748749118"
+
+    async def _cached_get(
+        self,
+        path: str,
+        endpoint: str,
+        params: Dict[str, Any],
+        parse: Callable[[Any], Any]
+    ) -> CachedResponse:
+        """GET через кэш ответов; в кэше хранится результат parse(json).
+
+        Свежий ответ отдаётся из памяти, устаревший - тоже, но с фоновой
+        перепроверкой; без записи в кэше выполняется запрос. Ответ с
+        no-cache устаревает сразу и отдаётся только после перепроверки,
+        ответ с no-store не кэшируется. Перепроверка условная
+        (If-None-Match / If-Modified-Since), если API прислал ETag или
+        Last-Modified, и тогда ответ 304 не несёт тела.
+        """
+        key = (path, tuple(sorted(params.items())))
+        entry = self.response_cache.get(key)
+        if entry is not None:
+            if time.monotonic() < entry.fresh_until:
+                self.response_stats['fresh'] += 1
+                return entry
+            if not entry.must_revalidate:
+                self.response_stats['stale'] += 1
+                self._revalidate_in_background(key, path, endpoint, params, parse)
+                return entry
+        return await self._response_flight.do(key, lambda: self._revalidate(key, path, endpoint, params, parse))
+
+    def _revalidate_in_background(self, key, path: str, endpoint: str, params: Dict[str, Any], parse: Callable[[Any], Any]):
+        if key in self._response_flight:
+            return
+        task = asyncio.ensure_future(
+            self._response_flight.do(key, lambda: self._revalidate(key, path, endpoint, params, parse))
+        )
+        self._revalidations.add(task)
+        task.add_done_callback(self._revalidation_done)
+
+    def _revalidation_done(self, task: asyncio.Task):
+        self._revalidations.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # Остаётся устаревший ответ, следующий запрос попробует снова
+            logger.warning("Не удалось обновить кэш ответа API: %s", task.exception())
+
+    async def _revalidate(self, key, path: str, endpoint: str, params: Dict[str, Any], parse: Callable[[Any], Any]) -> CachedResponse:
+        previous = self.response_cache.get(key, count=False)
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers['If-None-Match'] = previous.etag
+            if previous.last_modified:
+                headers['If-Modified-Since'] = previous.last_modified
+
+        response = await self._request('GET', path, endpoint, retry=True, raw=True, params=params, headers=headers)
+        directives = _cache_control(response)
+        max_age = _max_age(directives)
+        ttl = self.config.response_cache_ttl if max_age is None else max_age
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if response.status_code == 304 and previous is not None:
+            self.response_stats['not_modified'] += 1
+            data, digest = previous.data, previous.digest
+            # 304 не обязан повторять валидаторы - без них остаются прежние
+            etag = etag or previous.etag
+            last_modified = last_modified or previous.last_modified
+        else:
+            self.response_stats['fetched'] += 1
+            data = _parse(parse, await self._handle_response(response), endpoint)
+            digest = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+
+        entry = CachedResponse(
+            data=data,
+            digest=digest,
+            fresh_until=time.monotonic() + ttl,
+            etag=etag,
+            last_modified=last_modified,
+            must_revalidate='no-cache' in directives
+        )
+        if 'no-store' in directives:
+            self.response_cache.invalidate(key)
+        # Ответ без срока жизни и без валидаторов кэшировать незачем: перепроверить его нечем
+        elif self.config.response_cache_max_entries > 0 and (ttl > 0 or entry.etag or entry.last_modified):
+            self.response_cache.set(key, entry, ttl=ttl + self.config.response_cache_stale_ttl)
+        return entry
+
+    def response_cache_stats(self) -> Dict[str, Any]:
+        """Счётчики кэша ответов GET"""
+        stats = self.response_cache.stats()
+        stats.update(self.response_stats)
+        stats['coalesced'] = self._response_flight.coalesced
+        return stats
+
+    async def ping(self):
+        """Проверка доступности API"""
+        async with self._make_request() as client:
+            response = await client.get(f"{self.base_url}/")
+            response.raise_for_status()
+
+    async def warm_up(self, connections: int) -> int:
+        """Открытие нескольких соединений заранее (DNS, TCP и TLS до первых запросов).
+
+        Параллельные запросы к / заставляют пул открыть отдельное соединение
+        на каждый; после ответа они остаются в keep-alive. Возвращает число
+        успешных запросов.
+        """
+        connections = min(connections, self.config.max_keepalive_connections)
+        results = await asyncio.gather(*(self.ping() for _ in range(connections)), return_exceptions=True)
+        failed = [r for r in results if isinstance(r, BaseException)]
+        if failed:
+            logger.warning("Прогрев соединений с API: %s ошибок, первая: %s", len(failed), failed[0])
+        return len(results) - len(failed)
+
+    async def get_tenant_by_phone(self, phone: int) -> TenantProfile:
+        """Поиск пользователя по номеру телефона"""
+        data = await self._request('POST', '/check-tenant', 'check-tenant', retry=True, json={"phone": phone})
+        return _parse(TenantProfile.from_api, data, 'check-tenant')
+
+    async def get_apartments(self, tenant_id: int) -> Tuple[Apartment, ...]:
+        """Получение списка квартир пользователя"""
+        apartments, _ = await self.get_apartments_versioned(tenant_id)
+        return apartments
+
+    async def get_apartments_versioned(self, tenant_id: int) -> Tuple[Tuple[Apartment, ...], str]:
+        """Квартиры пользователя и хэш тела ответа (меняется только вместе с данными)"""
+        entry = await self._cached_get(
+            '/domo.apartment',
+            'domo.apartment',
+            {"tenant_id": tenant_id},
+            lambda data: parse_list(Apartment, data)
+        )
+        return entry.data, entry.digest
+
+    async def get_apartment_domofons(self, apartment_id: int, tenant_id: int) -> Tuple[Intercom, ...]:
+        """Получение списка домофонов квартиры"""
+        entry = await self._cached_get(
+            f'/domo.apartment/{apartment_id}/domofon',
+            'domo.apartment.domofon',
+            {"tenant_id": tenant_id},
+            lambda data: parse_list(Intercom, data)
+        )
+        return entry.data
+
+    async def resolve_domofons(self, tenant_id: int) -> List[Tuple[Apartment, Tuple[Intercom, ...]]]:
+        """Получение квартир пользователя вместе с их домофонами.
+
+        Домофоны квартир запрашиваются параллельно, но не более fanout_limit
+        запросов одновременно. Квартиры, для которых запрос не удался,
+        возвращаются с пустым списком домофонов.
+        """
+        apartments = await self.get_apartments(tenant_id)
+        semaphore = asyncio.Semaphore(self.config.fanout_limit)
+
+        async def fetch(apartment: Apartment) -> Tuple[Intercom, ...]:
+            if not apartment.id:
+                return ()
+            async with semaphore:
+                try:
+                    return await self.get_apartment_domofons(apartment.id, tenant_id)
+                except ApiClientError as e:
+                    logger.warning("Не удалось получить домофоны квартиры %s: %s", apartment.id, e)
+                    return ()
+
+        domofons = await asyncio.gather(*(fetch(apartment) for apartment in apartments))
+        return list(zip(apartments, domofons))
+
+    async def get_apartment_residents(self, domofon_id: int, tenant_id: int) -> List[Resident]:
+        """Жильцы всех квартир пользователя, к которым подключён домофон"""
+        residents = []
+        for apartment, domofons in await self.resolve_domofons(tenant_id):
+            if any(domofon.id == domofon_id for domofon in domofons):
+                residents.extend(apartment.tenants)
+        return residents
+
+    async def get_media_urls(
+        self,
+        domofon_ids: List[int],
+        tenant_id: int,
+        media_types: Optional[List[MediaType]] = None,
+        hedge: bool = False
+    ) -> Tuple[MediaUrls, ...]:
+        """Получение ссылок на медиа с камер домофонов"""
+        payload = {
+            "intercoms_id": list(domofon_ids),
+            "media_type": [m.value for m in (media_types or [MediaType.JPEG])]
         }
+        data = await self._request(
+            'POST',
+            '/domo.domofon/urlsOnType',
+            'urlsOnType',
+            retry=True,
+            hedge=hedge,
+            json=payload,
+            params={"tenant_id": tenant_id}
+        )
+        return _parse(lambda items: parse_list(MediaUrls, items), data, 'urlsOnType')
+
+    async def get_snapshot_media(self, domofon_id: int, tenant_id: int) -> Optional[MediaUrls]:
+        """Ссылки на снимок одного домофона (запросы объединяются в пакеты)"""
+        if self.config.snapshot_batch_window <= 0:
+            data = await self.get_media_urls([domofon_id], tenant_id, [MediaType.JPEG], hedge=True)
+            return data[0] if data else None
+        return await self.snapshot_batcher.get(domofon_id, tenant_id)
+
+    async def get_camera_clip(self, domofon_id: int, tenant_id: int) -> Optional[MediaUrls]:
+        """Ссылки на видео с камеры домофона и на снимок с неё (для превью).
+
+        None, если камера не отдаёт видео.
+        """
+        data = await self.get_media_urls([domofon_id], tenant_id, [MediaType.MP4, MediaType.JPEG])
+        return next((media for media in data if media.mp4), None)
+
+    async def stream_media(self, url: str, max_bytes: int, max_seconds: Optional[float] = None) -> AsyncIterator[bytes]:
+        """Файл с сервера камер по частям, не больше max_bytes байт.
+
+        Файл больше max_bytes или не дочитанный за max_seconds секунд -
+        MediaLimitError: обрезанный MP4 без индекса в конце не воспроизводится.
+        """
+        async with self._make_request() as client:
+            request = client.build_request('GET', url)
+            # Ключ API не должен уходить на сторонний сервер камер
+            request.headers.pop('x-api-key', None)
+            try:
+                response = await client.send(request, stream=True)
+            except httpx.RequestError as e:
+                raise ApiClientError(f"Ошибка соединения: {str(e)}")
+            try:
+                if response.status_code != 200:
+                    raise ApiClientError(f"HTTP ошибка: {response.status_code}", status_code=response.status_code)
+                length = response.headers.get('content-length', '')
+                if length.isdigit() and int(length) > max_bytes:
+                    raise MediaLimitError(f"Файл больше {max_bytes} байт")
+                deadline = time.monotonic() + max_seconds if max_seconds else None
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MediaLimitError(f"Файл больше {max_bytes} байт")
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise MediaLimitError(f"Файл не загружен за {max_seconds} с")
+                    yield chunk
+            finally:
+                await response.aclose()
+
+    async def download_media(self, url: str, max_bytes: int) -> bytes:
+        """Загрузка файла с сервера камер с ограничением размера"""
+        return b''.join([chunk async for chunk in self.stream_media(url, max_bytes)])
+
+    async def open_domofon(self, domophone_id: int, tenant_id: int) -> Any:
+        """Открытие двери домофона с передачей ошибок вызывающему коду"""
+        return await self._request(
+            'POST',
+            f'/domo.domofon/{domophone_id}/open',
+            'open',
+            json={"door_id": 0},
+            params={"tenant_id": tenant_id}
+        )
+
+    async def open_domofon_once(self, domophone_id: int, tenant_id: int) -> Tuple[Any, bool]:
+        """Открытие двери без повторных запросов при двойных нажатиях.
+
+        Пока открытие для (tenant_id, domophone_id) выполняется, повторные
+        вызовы ждут его результата; после успеха в течение
+        open_idempotency_window секунд результат отдаётся из памяти.
+        Возвращает (результат, fresh), где fresh=False означает, что запрос
+        к API выполнил другой вызов.
+        """
+        key = (tenant_id, domophone_id)
+        recent = self._recent_opens.get(key, _NOT_CACHED)
+        if recent is not _NOT_CACHED:
+            self.opens_deduplicated += 1
+            return recent, False
+
+        leader = key not in self._open_flight
+        result = await self._open_flight.do(key, lambda: self._open_and_remember(key))
+        if not leader:
+            self.opens_coalesced += 1
+        return result, leader
+
+    def open_pending(self, domophone_id: int, tenant_id: int) -> bool:
+        """Открытие двери уже выполняется или выполнено в окне open_idempotency_window"""
+        key = (tenant_id, domophone_id)
+        return key in self._open_flight or key in self._recent_opens
+
+    async def _open_and_remember(self, key: Tuple[int, int]) -> Any:
+        tenant_id, domophone_id = key
+        result = await self.open_domofon(domophone_id, tenant_id)
+        self.opens_performed += 1
+        self._recent_opens.set(key, result)
+        return result
+
+    def open_stats(self) -> Dict[str, int]:
+        """Счётчики открытий двери"""
+        return {
+            'performed': self.opens_performed,
+            'coalesced': self.opens_coalesced,
+            'deduplicated': self.opens_deduplicated
+        }
+
+    async def check_tenant(self, tenant_id: int) -> Optional[TenantInfo]:
+        """Получение информации о пользователе (с кэшированием)"""
+        cached = self.tenant_cache.get(tenant_id, _NOT_CACHED)
+        if cached is not _NOT_CACHED:
+            return cached
 
         try:
-            phone = phone_mapping.get(tenant_id, 79156562250)
-            async with self._make_request() as client:
-                response = await client.post(
-                    f"{self.base_url}/check-tenant",
-                    json={"phone": phone}
-                )
-                data = await self._handle_response(response)
-                
-                return TenantInfo(
-                    tenant_id=data.get('tenant_id'),
-                    name=data.get('name', 'Неизвестный'),
-                    telegram_chat_id=chat_id_mapping.get(tenant_id, ''),
-                    is_super_user=data.get('is_super_user', False)
-                )
+            return await self._tenant_flight.do(tenant_id, lambda: self._load_tenant(tenant_id))
         except Exception as e:
-            logger.error(f"Ошибка при проверке пользователя: {str(e)}", exc_info=True)
+            logger.error("Ошибка при проверке пользователя: %s", e, exc_info=True)
+            return None
+
+    async def _load_tenant(self, tenant_id: int) -> Optional[TenantInfo]:
+        """Запрос пользователя в API и сохранение результата в кэш"""
+        record = self.registry.get(tenant_id) if self.registry else None
+        if record is None:
+            # Пользователь не авторизовался в боте и не импортирован в реестр
+            self.tenant_cache.set(tenant_id, None, ttl=self.config.tenant_cache_negative_ttl)
             return None
 
+        try:
+            data = await self.get_tenant_by_phone(int(record.phone))
+        except ApiClientError as e:
+            # Неизвестного пользователя кэшируем ненадолго, временные сбои не кэшируем
+            if e.status_code in (404, 422):
+                self.tenant_cache.set(tenant_id, None, ttl=self.config.tenant_cache_negative_ttl)
+                return None
+            raise
+
+        info = TenantInfo(
+            tenant_id=data.tenant_id,
+            name=data.name,
+            telegram_chat_id=record.chat_id or '',
+            is_super_user=data.is_super_user
+        )
+        self.tenant_cache.set(tenant_id, info)
+        return info
+
+    def tenant_cache_stats(self) -> Dict[str, Any]:
+        """Счётчики кэша пользователей"""
+        stats = self.tenant_cache.stats()
+        stats['coalesced'] = self._tenant_flight.coalesced
+        return stats
+
     async def get_camera_snapshot(self, domofon_id: int, tenant_id: int) -> Optional[str]:
         """Получение URL снимка с камеры"""
         try:
-            payload = {
-                "intercoms_id": [domofon_id],
-                "media_type": [MediaType.JPEG.value]
-            }
-            
-            async with self._make_request() as client:
-                response = await client.post(
-                    f"{self.base_url}/domo.domofon/urlsOnType",
-                    json=payload,
-                    params={"tenant_id": tenant_id}
-                )
-                data = await self._handle_response(response)
-                return data[0].get('jpeg') if data else None
-                
+            media = await self.get_snapshot_media(domofon_id, tenant_id)
+            return media.jpeg if media else None
+
         except Exception as e:
-            logger.error(f"Ошибка при получении снимка: {str(e)}", exc_info=True)
+            logger.error("Ошибка при получении снимка: %s", e, exc_info=True)
             return None
 
     async def open_door(self, domophone_id: int, tenant_id: int) -> bool:
         """Открытие двери домофона"""
         try:
-            async with self._make_request() as client:
-                response = await client.post(
-                    f"{self.base_url}/domo.domofon/{domophone_id}/open",
-                    json={"door_id": 0},
-                    params={"tenant_id": tenant_id}
-                )
-                await self._handle_response(response)
-                return True
+            await self.open_domofon(domophone_id, tenant_id)
+            return True
         except Exception as e:
-            logger.error(f"Ошибка при открытии двери: {str(e)}", exc_info=True)
-            return False 
\ No newline at end of file
+            logger.error("Ошибка при открытии двери: %s", e, exc_info=True)
+            return False
@@ -0,0 +1,81 @@
+"""Один ASGI-процесс для вебхука Telegram и вебхука вызовов домофона.
+
+Бот и сервер вызовов делят Application, ApiClient, реестр и кэши.
+Обновления Telegram обрабатываются параллельно (BOT_CONCURRENT_UPDATES,
+по умолчанию 256). Запуск (несколько воркеров - несколько независимых
+процессов; entrypoint.sh по умолчанию запускает один):
+
+    hypercorn asgi:app --bind 0.0.0.0:5000 --workers 4
+
+Общими для воркеров остаются только база (сессии пользователей, реестр,
+сессии вызовов) и вызовы API. Всё остальное у каждого воркера своё:
+- лимиты Telegram (TG_GLOBAL_RATE) - при N воркерах их стоит делить на N;
+- объединение одновременных нажатий «Открыть» - дверь может открыться
+  по разу на каждый воркер;
+- подавление повторных доставок вызова (CALL_DEDUPE_TTL) - повтор,
+  попавший в другой воркер, отправит уведомление ещё раз;
+- кэш снимков и file_id - каждый воркер загружает снимок в Telegram сам;
+- трансляции с камер - «Обновить» и «Стоп», попавшие в другой воркер,
+  трансляцию не найдут, поэтому для трансляций нужен один воркер или
+  привязка чата к воркеру на балансировщике.
+"""
+from quart import request, jsonify
+import asyncio
+import hmac
+import logging
+import os
+
+from bot import DomophoneBot
+from webhook_server import DomophoneWebhookServer
+
+logger = logging.getLogger(__name__)
+
+class DomophoneAsgiServer(DomophoneWebhookServer):
+    def __init__(self):
+        self.domophone_bot = DomophoneBot(webhook_mode=True)
+        super().__init__(
+            bot=self.domophone_bot.app.bot,
+            api_client=self.domophone_bot.api_client,
+            registry=self.domophone_bot.registry,
+            snapshot_cache=self.domophone_bot.snapshot_cache,
+            call_sessions=self.domophone_bot.call_sessions
+        )
+        self.telegram_webhook_url = os.getenv('TELEGRAM_WEBHOOK_URL', '')
+        self.telegram_webhook_secret = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
+        self.telegram_webhook_path = os.getenv('TELEGRAM_WEBHOOK_PATH', '/webhook/telegram')
+        self._setup_telegram_route()
+
+    def _setup_telegram_route(self):
+        @self.app.route(self.telegram_webhook_path, methods=['POST'])
+        async def telegram_update():
+            if self.telegram_webhook_secret:
+                token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                if not hmac.compare_digest(token, self.telegram_webhook_secret):
+                    return jsonify({'error': 'Неверный секрет', 'status': 'error'}), 403
+
+            data = await request.get_json(force=True, silent=True)
+            if not data:
+                return jsonify({'error': 'Пустое обновление', 'status': 'error'}), 400
+
+            # Обработка идёт в Application, Telegram получает ответ сразу
+            await self.domophone_bot.process_webhook_update(data)
+            return jsonify({'status': 'ok'})
+
+    async def startup(self):
+        await super().startup()
+        await self.domophone_bot.start_webhook(
+            url=self.telegram_webhook_url or None,
+            secret_token=self.telegram_webhook_secret or None
+        )
+
+    async def _warm_tenant(self, tenant_id: int):
+        await asyncio.gather(super()._warm_tenant(tenant_id), self.domophone_bot.warm_tenant(tenant_id))
+
+    async def shutdown(self):
+        # Сначала перестаём брать обновления, затем разбираем вызовы и закрываем ресурсы
+        await self.domophone_bot.stop_webhook()
+        await super().shutdown()
+        await self.domophone_bot.shutdown_webhook()
+
+server = DomophoneAsgiServer()
+app = server.app
@@ -0,0 +1,264 @@
+"""Локальные заглушки API домофонов и Telegram Bot API для бенчмарков.
+
+Обе заглушки - приложения Quart с настраиваемой задержкой и долей ошибок.
+Они работают в отдельном процессе (start_fakes), чтобы не делить event loop
+с измеряемым сервисом; счётчики запросов отдаются по GET /_bench/stats.
+Данные синтетические: у пользователя N одна квартира N с домофонами
+N*10+1 и N*10+2, телефон 7900000NNNN и chat id 100000+N.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+import asyncio
+import contextlib
+import multiprocessing
+import random
+import socket
+import time
+
+from quart import Quart, Response, jsonify, request
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    async def delay(self):
+        seconds = max(0.0, random.gauss(self.latency, self.jitter)) if self.jitter else self.latency
+        if seconds:
+            await asyncio.sleep(seconds)
+
+    def fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+def tenant_phone(tenant_id: int) -> str:
+    return f'7900000{tenant_id:04d}'
+
+def tenant_chat_id(tenant_id: int) -> int:
+    return 100000 + tenant_id
+
+def tenant_domofons(tenant_id: int) -> List[int]:
+    return [tenant_id * 10 + 1, tenant_id * 10 + 2]
+
+class FakeUpstream:
+    """Заглушка API домофонов с эндпоинтами, которые вызывает ApiClient"""
+
+    def __init__(self, faults: Faults, snapshot_bytes: int = 30_000):
+        self.faults = faults
+        self.base_url = ''
+        self.requests: Dict[str, int] = {}
+        self._snapshot = bytes(random.getrandbits(8) for _ in range(snapshot_bytes))
+        self.app = Quart('fake_upstream')
+        self._setup_routes()
+
+    def _count(self, endpoint: str):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    async def _inject(self, endpoint: str):
+        self._count(endpoint)
+        await self.faults.delay()
+        if self.faults.fail():
+            return jsonify({'detail': 'Injected failure'}), 503
+        return None
+
+    def _setup_routes(self):
+        app = self.app
+
+        @app.route('/')
+        async def root():
+            return jsonify({'status': 'ok'})
+
+        @app.route('/_bench/stats')
+        async def stats():
+            return jsonify(self.requests)
+
+        @app.route('/check-tenant', methods=['POST'])
+        async def check_tenant():
+            failure = await self._inject('check-tenant')
+            if failure:
+                return failure
+            phone = str((await request.get_json())['phone'])
+            tenant_id = int(phone[-4:])
+            return jsonify({'tenant_id': tenant_id, 'name': f'Житель {tenant_id}', 'is_super_user': False})
+
+        @app.route('/domo.apartment')
+        async def apartments():
+            failure = await self._inject('domo.apartment')
+            if failure:
+                return failure
+            tenant_id = int(request.args['tenant_id'])
+            return jsonify([{
+                'id': tenant_id,
+                'name': f'Квартира {tenant_id}',
+                'location': {'readable_address': 'ул. Тестовая, 1', 'apartments_number': str(tenant_id)},
+                'tenants': [{'phone': tenant_phone(tenant_id), 'name': f'Житель {tenant_id}', 'status': {'role': 1}}]
+            }])
+
+        @app.route('/domo.apartment/<int:apartment_id>/domofon')
+        async def domofons(apartment_id: int):
+            failure = await self._inject('domo.apartment.domofon')
+            if failure:
+                return failure
+            return jsonify([
+                {'id': domofon_id, 'name': f'Подъезд {index}'}
+                for index, domofon_id in enumerate(tenant_domofons(apartment_id), start=1)
+            ])
+
+        @app.route('/domo.domofon/urlsOnType', methods=['POST'])
+        async def urls_on_type():
+            failure = await self._inject('urlsOnType')
+            if failure:
+                return failure
+            ids = (await request.get_json())['intercoms_id']
+            return jsonify([{'id': i, 'jpeg': f'{self.base_url}/media/{i}.jpg'} for i in ids])
+
+        @app.route('/domo.domofon/<int:domofon_id>/open', methods=['POST'])
+        async def open_door(domofon_id: int):
+            failure = await self._inject('open')
+            if failure:
+                return failure
+            return jsonify({'success': True, 'domofon_id': domofon_id})
+
+        @app.route('/media/<int:domofon_id>.jpg')
+        async def media(domofon_id: int):
+            self._count('media')
+            await self.faults.delay()
+            return Response(self._snapshot, content_type='image/jpeg')
+
+class FakeTelegram:
+    """Заглушка Bot API: отвечает на методы, которые использует бот, и считает их"""
+
+    def __init__(self, faults: Faults, retry_after_rate: float = 0.0):
+        self.faults = faults
+        self.retry_after_rate = retry_after_rate
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+        self.app = Quart('fake_telegram')
+        self._setup_routes()
+
+    def _message(self, params: Dict[str, Any], method: str) -> Dict[str, Any]:
+        self._message_id += 1
+        message = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id') or 0), 'type': 'private'}
+        }
+        if method in ('sendPhoto', 'editMessageMedia'):
+            message['photo'] = [{
+                'file_id': f'photo-{self._message_id}',
+                'file_unique_id': f'u-{self._message_id}',
+                'width': 640,
+                'height': 480
+            }]
+            message['caption'] = params.get('caption', '')
+        else:
+            message['text'] = params.get('text', '')
+        return message
+
+    def _setup_routes(self):
+        @self.app.route('/_bench/stats')
+        async def stats():
+            return jsonify(self.calls)
+
+        @self.app.route('/bot<token>/<method>', methods=['POST', 'GET'])
+        async def bot_api(token: str, method: str):
+            self.calls[method] = self.calls.get(method, 0) + 1
+            params: Dict[str, Any] = dict(await request.form)
+            params.update(await request.get_json(silent=True) or {})
+            await self.faults.delay()
+
+            if self.retry_after_rate and random.random() < self.retry_after_rate:
+                return jsonify({
+                    'ok': False, 'error_code': 429,
+                    'description': 'Too Many Requests: retry after 1',
+                    'parameters': {'retry_after': 1}
+                }), 429
+            if self.faults.fail():
+                return jsonify({'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}), 500
+
+            if method == 'getMe':
+                result: Any = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+            elif method.startswith('send') or method.startswith('edit'):
+                result = self._message(params, method)
+            else:
+                result = True
+            return jsonify({'ok': True, 'result': result})
+
+def free_port() -> int:
+    with contextlib.closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@dataclass
+class ServedApp:
+    url: str
+    task: asyncio.Task
+    stop: asyncio.Event
+    sock: socket.socket
+
+    async def close(self):
+        self.stop.set()
+        await self.task
+        # Дескриптор уже закрыт hypercorn
+        self.sock.detach()
+
+async def wait_port(port: int, attempts: int = 100):
+    """Ожидание, пока на порту начнут принимать соединения"""
+    for _ in range(attempts):
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f'Порт {port} не открылся')
+
+async def serve(app, port: int = 0) -> ServedApp:
+    """Запуск ASGI-приложения через hypercorn на 127.0.0.1"""
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    port = port or free_port()
+    # hypercorn создаёт сокет с proto=0, и asyncio не включает на нём TCP_NODELAY:
+    # ответ (заголовки и тело отдельными записями) задерживается на ~40 мс
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind(('127.0.0.1', port))
+    sock.set_inheritable(True)
+    config = Config()
+    config.bind = [f'fd://{sock.fileno()}']
+    config.accesslog = None
+    config.errorlog = None
+    stop = asyncio.Event()
+    task = asyncio.create_task(hypercorn_serve(app, config, shutdown_trigger=stop.wait))
+    await wait_port(port)
+    return ServedApp(f'http://127.0.0.1:{port}', task, stop, sock)
+
+def _run_fakes(upstream_port: int, telegram_port: int, upstream_faults: Faults, telegram_faults: Faults, retry_after_rate: float):
+    async def main():
+        upstream = FakeUpstream(upstream_faults)
+        upstream.base_url = f'http://127.0.0.1:{upstream_port}'
+        telegram = FakeTelegram(telegram_faults, retry_after_rate)
+        served = await asyncio.gather(serve(upstream.app, upstream_port), serve(telegram.app, telegram_port))
+        await asyncio.gather(*(s.task for s in served))
+
+    asyncio.run(main())
+
+async def start_fakes(
+    upstream_faults: Faults,
+    telegram_faults: Faults,
+    retry_after_rate: float = 0.0
+) -> Tuple[str, str, multiprocessing.Process]:
+    """Запуск обеих заглушек в отдельном процессе; возвращает их адреса и процесс"""
+    upstream_port, telegram_port = free_port(), free_port()
+    # spawn, а не fork: дочерний процесс не должен наследовать работающий event loop
+    process = multiprocessing.get_context('spawn').Process(
+        target=_run_fakes,
+        args=(upstream_port, telegram_port, upstream_faults, telegram_faults, retry_after_rate),
+        daemon=True
+    )
+    process.start()
+    await wait_port(upstream_port)
+    await wait_port(telegram_port)
+    return f'http://127.0.0.1:{upstream_port}', f'http://127.0.0.1:{telegram_port}', process
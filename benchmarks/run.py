@@ -0,0 +1,276 @@
+"""Нагрузочные сценарии без сети: сервер вебхуков и обработчики бота
+против локальных заглушек API домофонов и Telegram.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario call_burst --calls 2000 --concurrency 100
+    python -m benchmarks.run --upstream-latency 0.05 --upstream-jitter 0.02 --upstream-errors 0.05
+
+Для каждого сценария выводятся пропускная способность и p50/p95/p99.
+По умолчанию лимиты Telegram отключены, чтобы измерялся код сервиса;
+--real-rate-limits оставляет настройки TG_* из окружения.
+Заглушки работают в отдельном процессе, а генератор нагрузки - в одном
+процессе с сервисом, поэтому цифры стоит сравнивать между запусками
+на одной машине, а не как абсолютную ёмкость.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import Faults, serve, start_fakes, tenant_chat_id, tenant_domofons, tenant_phone
+
+SCENARIOS = ('call_burst', 'call_burst_async', 'callback_storm')
+
+@dataclass
+class Result:
+    scenario: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    duration: float = 0.0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> Dict[str, Any]:
+        total = len(self.latencies) + self.errors
+        return {
+            'scenario': self.scenario,
+            'requests': total,
+            'errors': self.errors,
+            'throughput': total / self.duration if self.duration else 0.0,
+            'p50_ms': self.percentile(0.50) * 1000,
+            'p95_ms': self.percentile(0.95) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': max(self.latencies, default=0.0) * 1000,
+            **self.extra
+        }
+
+async def drive(result: Result, count: int, concurrency: int, make: Callable[[int], Awaitable[bool]]):
+    """Выполнение count операций, не более concurrency одновременно"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                ok = await make(i)
+            except Exception:
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - started)
+            else:
+                result.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    result.duration = time.perf_counter() - started
+
+async def fake_stats(url: str) -> Dict[str, int]:
+    import httpx
+
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f'{url}/_bench/stats')).json()
+
+async def notifications_sent(telegram_url: str) -> int:
+    calls = await fake_stats(telegram_url)
+    return calls.get('sendPhoto', 0) + calls.get('sendMessage', 0)
+
+def seed_registry(tenants: int):
+    import db
+    from tenant_registry import TenantRecord, _upsert_many
+
+    conn = db.connect()
+    try:
+        _upsert_many(conn, [
+            TenantRecord(t, tenant_phone(t), str(tenant_chat_id(t)), f'Житель {t}')
+            for t in range(1, tenants + 1)
+        ])
+    finally:
+        conn.close()
+
+async def call_burst(args, telegram_url: str, mode: str) -> Result:
+    """Пачка вызовов домофона в /webhook/call"""
+    import httpx
+    from webhook_server import DomophoneWebhookServer
+
+    os.environ['CALL_DELIVERY_MODE'] = mode
+    server = DomophoneWebhookServer()
+    served = await serve(server.app)
+    result = Result('call_burst' if mode == 'sync' else 'call_burst_async')
+    sent_before = await notifications_sent(telegram_url)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=served.url, limits=limits, timeout=60) as client:
+        async def call(i: int) -> bool:
+            tenant_id = random.randint(1, args.tenants)
+            response = await client.post('/webhook/call', json={
+                'domofon_id': random.choice(tenant_domofons(tenant_id)),
+                'tenant_id': tenant_id,
+                'event_id': f'bench-{mode}-{i}'
+            })
+            return response.status_code in (200, 202)
+
+        await drive(result, args.calls, args.concurrency, call)
+
+    if mode == 'async':
+        # Ждём, пока очередь разошлёт принятые вызовы
+        started = time.perf_counter() - result.duration
+        deadline = time.perf_counter() + 60
+        while server.dispatcher.depth and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        await served.close()
+        drained = time.perf_counter() - started
+        result.extra['drain_s'] = drained
+        result.extra['delivered_per_s'] = (await notifications_sent(telegram_url) - sent_before) / drained
+    else:
+        await served.close()
+    result.extra['notifications'] = await notifications_sent(telegram_url) - sent_before
+    return result
+
+async def callback_storm(args) -> Result:
+    """Нажатия «Открыть» и «Камера» напрямую в обработчики DomophoneBot"""
+    try:
+        from telegram import Update
+        from bot import DomophoneBot
+    except ImportError as e:
+        result = Result('callback_storm')
+        result.extra['skipped'] = str(e)
+        return result
+
+    bot = DomophoneBot(webhook_mode=True)
+    await bot.start_webhook()
+    for t in range(1, args.tenants + 1):
+        bot.app.user_data[tenant_chat_id(t)]['tenant_id'] = t
+
+    result = Result('callback_storm')
+
+    async def press(i: int) -> bool:
+        tenant_id = random.randint(1, args.tenants)
+        chat_id = tenant_chat_id(tenant_id)
+        action = 'snapshot' if random.random() < args.snapshot_ratio else 'open'
+        update = Update.de_json({
+            'update_id': i + 1,
+            'callback_query': {
+                'id': str(i),
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+                'chat_instance': str(chat_id),
+                'data': f'{action}_{random.choice(tenant_domofons(tenant_id))}',
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'text': 'Домофоны'
+                }
+            }
+        }, bot.app.bot)
+        await bot.app.process_update(update)
+        return True
+
+    await drive(result, args.callbacks, args.concurrency, press)
+    await bot.stop_webhook()
+    await bot.shutdown_webhook()
+    result.extra['open_stats'] = bot.api_client.open_stats()
+    return result
+
+def print_table(rows: List[Dict[str, Any]]):
+    columns = ('scenario', 'requests', 'errors', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    print(' '.join(f'{c:>16}' for c in columns))
+    for row in rows:
+        if 'skipped' in row:
+            print(f"{row['scenario']:>16} пропущен: {row['skipped']}")
+            continue
+        print(' '.join(
+            f'{row[c]:>16.1f}' if isinstance(row[c], float) else f'{row[c]:>16}'
+            for c in columns
+        ))
+        extra = {k: v for k, v in row.items() if k not in columns}
+        if extra:
+            print(f"{'':>16} {extra}")
+
+async def main_async(args) -> List[Dict[str, Any]]:
+    upstream_url, telegram_url, fakes = await start_fakes(
+        Faults(args.upstream_latency, args.upstream_jitter, args.upstream_errors),
+        Faults(args.telegram_latency, args.telegram_jitter, args.telegram_errors),
+        retry_after_rate=args.telegram_retry_after
+    )
+
+    os.environ.update({
+        'API_URL': upstream_url,
+        'API_TOKEN': 'bench-api-token',
+        'TELEGRAM_TOKEN': '123456:bench-telegram-token',
+        'TELEGRAM_BASE_URL': f'{telegram_url}/bot',
+        'METRICS_PORT': '0',
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        'REGISTRY_RELOAD_INTERVAL': '0'
+    })
+    if not args.real_rate_limits:
+        os.environ.update({
+            'TG_GLOBAL_RATE': '1000000', 'TG_GLOBAL_BURST': '1000000',
+            'TG_CHAT_RATE': '1000000', 'TG_CHAT_BURST': '1000000'
+        })
+    seed_registry(args.tenants)
+
+    rows = []
+    try:
+        for scenario in args.scenario:
+            if scenario == 'call_burst':
+                result = await call_burst(args, telegram_url, 'sync')
+            elif scenario == 'call_burst_async':
+                result = await call_burst(args, telegram_url, 'async')
+            else:
+                result = await callback_storm(args)
+            rows.append(result.summary())
+        rows.append({'scenario': 'upstream_requests', **await fake_stats(upstream_url)})
+        rows.append({'scenario': 'telegram_calls', **await fake_stats(telegram_url)})
+    finally:
+        fakes.terminate()
+        fakes.join()
+    return rows
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки сервера вебхуков и бота на заглушках")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help="Сценарий (можно несколько, по умолчанию все)")
+    parser.add_argument('--calls', type=int, default=500, help="Число вызовов домофона")
+    parser.add_argument('--callbacks', type=int, default=500, help="Число нажатий кнопок")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--tenants', type=int, default=50)
+    parser.add_argument('--snapshot-ratio', type=float, default=0.3, help="Доля нажатий «Камера» среди нажатий")
+    parser.add_argument('--upstream-latency', type=float, default=0.02, help="Средняя задержка API, с")
+    parser.add_argument('--upstream-jitter', type=float, default=0.005)
+    parser.add_argument('--upstream-errors', type=float, default=0.0, help="Доля ответов 503 от API")
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help="Средняя задержка Bot API, с")
+    parser.add_argument('--telegram-jitter', type=float, default=0.01)
+    parser.add_argument('--telegram-errors', type=float, default=0.0, help="Доля ответов 500 от Bot API")
+    parser.add_argument('--telegram-retry-after', type=float, default=0.0, help="Доля ответов 429 от Bot API")
+    parser.add_argument('--real-rate-limits', action='store_true', help="Не отключать лимиты TG_*")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Вывод результатов в JSON")
+    args = parser.parse_args(argv)
+    args.scenario = args.scenario or list(SCENARIOS)
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # База бенчмарка - во временном каталоге
+        os.environ['DB_PATH'] = os.path.join(tmp, 'bench.db')
+        rows = asyncio.run(main_async(args))
+
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print_table(rows[:-2])
+        for row in rows[-2:]:
+            print(row)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
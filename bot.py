@@ -1,39 +1,303 @@
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
+# Первым: время запуска отсчитывается с импорта startup
+from startup import HEALTH_ROUTES, REPORT as STARTUP, warm_up
+from dotenv import load_dotenv
+
+# Переменные окружения загружаются до импорта модулей, которые их читают
+load_dotenv()
+
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, Message
+from telegram.error import BadRequest
+from telegram.helpers import escape_markdown
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler
 from telegram.ext import ContextTypes, filters
-import httpx
+import asyncio
 import logging
-import json
 import os
-from dotenv import load_dotenv
-from app.core.config import settings
-from fastapi import HTTPException
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Awaitable, List, Sequence
 from datetime import datetime
-
-# Загружаем переменные окружения
-load_dotenv()
+from api_client import ApiClient, ApiClientConfig, ApiClientError, MediaLimitError
+from models import Apartment
+from cache import SingleFlight, SWRCache, TTLCache
+from telegram_scheduler import TelegramRateLimiter, RateLimiterConfig, Priority, outbound_priority
+from media_cache import SnapshotCache, SnapshotCacheConfig, ClipSender, ClipConfig
+from live_view import LiveViewManager, LiveViewConfig, stopped_keyboard
+from persistence import SQLitePersistence
+from tenant_registry import TenantRegistry, TenantRecord
+from call_sessions import CallSession, CallSessionStore, CallSessionConfig, IGNORED, OPENED
+from status_report import IntercomStatus, StatusConfig, StatusReport, collect_status
+import metrics
+from logging_setup import setup_logging
 
 # Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+setup_logging()
 logger = logging.getLogger(__name__)
+STARTUP.mark('imports')
 
 # Конфигурация
-API_URL = settings.API_URL
-TELEGRAM_TOKEN = settings.TELEGRAM_TOKEN
+API_URL = os.getenv('API_URL', '')
+API_TOKEN = os.getenv('API_TOKEN', '')
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '')
 
-# Нужно добавить обработку ошибок при отсутствии TELEGRAM_TOKEN
-if not TELEGRAM_TOKEN:
-    raise ValueError("Не задан TELEGRAM_TOKEN в .env файле")
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+
+APARTMENTS_FOOTER = (
+    "*Доступные команды:*\n"
+    "📱 /domofons - Управление домофонами\n"
+    "ℹ️ /help - Справка по командам\n"
+)
+
+def _format_phone(phone: str) -> str:
+    if phone and len(phone) == 11:
+        return f"+{phone[0]} ({phone[1:4]}) {phone[4:7]}-{phone[7:9]}-{phone[9:]}"
+    return phone
+
+def _render_apartment(idx: int, apartment: Apartment) -> str:
+    """Блок сообщения об одной квартире"""
+    lines = [f"*Квартира #{idx}*", f"📍 Адрес: `{apartment.address}`"]
+    if apartment.number:
+        lines.append(f"🚪 Номер квартиры: `{apartment.number}`")
+    if apartment.paid_before:
+        lines.append(f"💳 Оплачено до: `{apartment.paid_before}`")
+
+    if apartment.tenants:
+        lines.append("\n👥 *Жильцы:*")
+        for tenant in apartment.tenants:
+            role_text = "👑 Владелец" if tenant.is_owner else "👤 Жилец"
+            lines.append(f"• {tenant.name} ({role_text})")
+            lines.append(f"  📱 `{_format_phone(tenant.phone)}`")
+
+    lines.append("\n" + "─" * 30 + "\n\n")
+    return "\n".join(lines)
+
+def _fit_blocks(blocks: List[str], limit: int):
+    for block in blocks:
+        if len(block) <= limit:
+            yield block
+            continue
+        for line in block.splitlines(keepends=True):
+            while len(line) > limit:
+                yield line[:limit]
+                line = line[limit:]
+            if line:
+                yield line
+
+def split_message(blocks: List[str], limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Склейка блоков в сообщения не длиннее limit.
+
+    Блоки не разрезаются, чтобы не ломать разметку Markdown; слишком
+    длинный блок делится по строкам.
+    """
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for block in _fit_blocks(blocks, limit):
+        if current and size + len(block) > limit:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(block)
+        size += len(block)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+# reply_markup по умолчанию в _set_status: оставить кнопки сообщения
+_KEEP_MARKUP = object()
+
+class _PlaceholderState:
+    """Заглушка нажатия («Открываю…») и начало показа результата"""
 
-class DomophoneBot:
     def __init__(self):
+        self.edit: Optional[asyncio.Future] = None
+        self.result_started = False
+
+# Заглушка нажатия, которое обрабатывает текущая задача (см. _run_with_placeholder)
+_placeholder: ContextVar[Optional[_PlaceholderState]] = ContextVar('callback_placeholder', default=None)
+
+async def _before_result_edit():
+    """Результат нажатия показывается после заглушки, а начатый результат отменяет её"""
+    state = _placeholder.get()
+    if state is None:
+        return
+    state.result_started = True
+    if state.edit is not None:
+        await asyncio.gather(state.edit, return_exceptions=True)
+
+# Отделяет строку статуса нажатия от исходного текста сообщения с кнопками
+STATUS_SEPARATOR = "\n\n➖➖➖\n"
+
+def with_status(text: str, status: str) -> str:
+    """Текст сообщения с новой строкой статуса вместо прежней"""
+    return text.split(STATUS_SEPARATOR, 1)[0] + STATUS_SEPARATOR + status
+
+def _message_markdown(message: Message) -> str:
+    """Текст или подпись сообщения в Markdown, чтобы правка сохранила форматирование"""
+    try:
+        return (message.caption_markdown if message.photo else message.text_markdown) or ''
+    except ValueError:
+        # Разметку, которой нет в Markdown, передать нельзя - остаётся простой текст
+        return (message.caption if message.photo else message.text) or ''
+
+def media_error_status(e: ApiClientError, media: str = "снимка") -> str:
+    """Строка статуса для ошибки получения снимка или видео"""
+    if e.status_code is None:
+        return "❌ Ошибка соединения с сервером"
+    return f"❌ Ошибка получения {media}: {escape_markdown(e.detail_message)}"
+
+def render_apartments(apartments: Sequence[Apartment]) -> List[str]:
+    """Сообщения со списком квартир, разбитые по лимиту Telegram"""
+    blocks = ["🏘 *Информация о ваших квартирах*\n\n"]
+    blocks.extend(_render_apartment(idx, apartment) for idx, apartment in enumerate(apartments, 1))
+    blocks.append(APARTMENTS_FOOTER)
+    return split_message(blocks)
+
+def _render_intercom_status(status: IntercomStatus) -> str:
+    title = f"*{escape_markdown(status.intercom.name)}* (#{status.intercom.id})"
+    if status.reachable:
+        state = f"🟢 {title} - снимок за {status.latency:.2f} с"
+    elif status.reachable is False:
+        state = f"🔴 {title} - {escape_markdown(status.error or 'недоступен')}"
+    else:
+        state = f"⚪️ {title} - нет ответа"
+    return f"{state}\n   📍 {escape_markdown(status.address)} · 📞 {status.calls}\n"
+
+def render_status(report: StatusReport, page_size: int) -> List[str]:
+    """Страницы сводки /status: сначала недоступные и не ответившие домофоны, затем самые медленные"""
+    header = (
+        "📊 *Состояние домофонов*\n"
+        f"🟢 Доступны: {report.reachable}  🔴 Недоступны: {report.unreachable}  ⚪️ Нет ответа: {report.pending}\n"
+        f"📞 Вызовов за {report.calls_window / 3600:g} ч: {sum(s.calls for s in report.intercoms)}\n"
+        f"⏱ Проверено за {report.elapsed:.1f} с\n"
+    )
+    if not report.complete:
+        header += "⚠️ Ответили не все домофоны"
+        if report.missing_apartments:
+            header += f", квартир без данных: {report.missing_apartments}"
+        header += "\n"
+
+    order = {False: 0, None: 1, True: 2}
+    statuses = sorted(report.intercoms, key=lambda s: (order[s.reachable], -(s.latency or 0.0)))
+    lines = [_render_intercom_status(status) for status in statuses] or ["Домофоны не найдены\n"]
+    pages = [lines[start:start + page_size] for start in range(0, len(lines), max(1, page_size))]
+    return [
+        f"{header}\n{''.join(page)}\nСтраница {number} из {len(pages)}"
+        for number, page in enumerate(pages, 1)
+    ]
+
+def status_keyboard(page: int, pages: int) -> InlineKeyboardMarkup:
+    row = []
+    if page > 0:
+        row.append(InlineKeyboardButton("◀️", callback_data=f"status_{page - 1}"))
+    row.append(InlineKeyboardButton("🔄 Обновить", callback_data=f"statusrefresh_{page}"))
+    if page < pages - 1:
+        row.append(InlineKeyboardButton("▶️", callback_data=f"status_{page + 1}"))
+    return InlineKeyboardMarkup([row])
+
+class DomophoneBot:
+    def __init__(self, webhook_mode: bool = False):
+        """webhook_mode - обновления приходят через ASGI-вебхук (asgi.py), а не long polling"""
         if not TELEGRAM_TOKEN:
-            raise ValueError("Не задан TELEGRAM_TOKEN")
-        self.app = Application.builder().token(TELEGRAM_TOKEN).build()
+            raise ValueError("Не задан TELEGRAM_TOKEN в .env файле")
+        self.webhook_mode = webhook_mode
+        self.registry = TenantRegistry(reload_interval=float(os.getenv('REGISTRY_RELOAD_INTERVAL', 30)))
+        self.api_client = ApiClient(API_URL, API_TOKEN, ApiClientConfig.from_env(), registry=self.registry)
+        self.snapshot_cache = SnapshotCache(self.api_client, SnapshotCacheConfig.from_env())
+        self.live_views = LiveViewManager(self.snapshot_cache, LiveViewConfig.from_env())
+        self.clip_sender = ClipSender(self.api_client, ClipConfig.from_env())
+        # Сессии вызовов создаёт сервер вебхуков, бот проверяет по ним нажатия в уведомлениях
+        self.call_sessions = CallSessionStore(config=CallSessionConfig.from_env())
+        # Домофоны пользователя и готовая клавиатура к ним, кэш по tenant_id
+        self._domofons_cache = SWRCache(
+            maxsize=int(os.getenv('DOMOFONS_CACHE_MAX_ENTRIES', 10000)),
+            ttl=float(os.getenv('DOMOFONS_CACHE_TTL', 60)),
+            stale_ttl=float(os.getenv('DOMOFONS_CACHE_STALE_TTL', 3600))
+        )
+        # Сводка /status для суперпользователей: одновременные запросы одного
+        # пользователя объединяются, страницы хранятся для листания
+        self.status_config = StatusConfig.from_env()
+        self._status_flight = SingleFlight()
+        self._status_pages = TTLCache(
+            maxsize=int(os.getenv('STATUS_PAGES_MAX_ENTRIES', 1000)),
+            ttl=float(os.getenv('STATUS_PAGES_TTL', 3600))
+        )
+        # Готовые сообщения о квартирах: tenant_id -> (хэш ответа API, сообщения)
+        self._apartments_messages = TTLCache(
+            maxsize=int(os.getenv('APARTMENTS_MESSAGE_CACHE_MAX_ENTRIES', 10000)),
+            ttl=float(os.getenv('APARTMENTS_MESSAGE_CACHE_TTL', 3600))
+        )
+        metrics.register_cache('tenants', self.api_client.tenant_cache_stats)
+        metrics.register_cache('api_responses', self.api_client.response_cache_stats)
+        metrics.register_cache('apartment_messages', self._apartments_messages.stats)
+        metrics.register_cache('snapshots', self.snapshot_cache.stats)
+        metrics.register_cache('live_views', self.live_views.stats)
+        metrics.register_queue('videos', self.clip_sender.stats)
+        metrics.register_cache('domofons', self._domofons_cache.stats)
+        metrics.register_cache('call_sessions', self.call_sessions.stats)
+        # В режиме вебхука /metrics отдаёт ASGI-приложение
+        self.metrics_port = 0 if webhook_mode else int(os.getenv('METRICS_PORT', 9100))
+        self._metrics_server = None
+        self._warmup_task: Optional[asyncio.Task] = None
+        # Через сколько секунд ожидания ответа API в сообщении появляется «Открываю…»
+        self.callback_placeholder_delay = float(os.getenv('CALLBACK_PLACEHOLDER_DELAY', 0.3))
+        # Через вебхук обновления всех пользователей идут в один процесс, и при
+        # последовательной обработке одно медленное открытие двери или /status
+        # задерживает остальных; 256 - значение PTB для concurrent_updates(True)
+        concurrent_updates = int(os.getenv('BOT_CONCURRENT_UPDATES', 256 if webhook_mode else 0))
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .rate_limiter(TelegramRateLimiter(RateLimiterConfig.from_env()))
+            .persistence(SQLitePersistence(
+                flush_interval=float(os.getenv('SESSION_FLUSH_INTERVAL', 1.0)),
+                update_interval=float(os.getenv('SESSION_UPDATE_INTERVAL', 5.0))
+            ))
+            .concurrent_updates(concurrent_updates if concurrent_updates > 0 else False)
+            .post_init(self._on_startup)
+            .post_shutdown(self._on_shutdown)
+        )
+        if os.getenv('TELEGRAM_BASE_URL'):
+            builder = builder.base_url(os.getenv('TELEGRAM_BASE_URL'))
+        if webhook_mode:
+            builder = builder.updater(None)
+        self.app = builder.build()
         self.setup_handlers()
+
+    async def _on_startup(self, application: Application):
+        """Открытие пула соединений с API и загрузка реестра при запуске.
+
+        Прогрев запускается в фоне; в режиме вебхука его выполняет
+        ASGI-сервер, когда поднято всё приложение.
+        """
+        # Сборка Application и getMe в Application.initialize()
+        STARTUP.mark('telegram')
+        with STARTUP.phase('registry'):
+            await self.registry.start()
+        await self.api_client.start()
+        if self.metrics_port and self._metrics_server is None:
+            self._metrics_server = await metrics.start_metrics_server(port=self.metrics_port, routes=HEALTH_ROUTES)
+        if not self.webhook_mode:
+            self._warmup_task = asyncio.ensure_future(warm_up(self.api_client, self.registry, self.warm_tenant))
+
+    async def warm_tenant(self, tenant_id: int):
+        """Загрузка домофонов пользователя и клавиатуры к ним в кэш"""
+        await self._domofons_cache.get(tenant_id, lambda: self._load_domofons_keyboard(tenant_id))
+
+    async def _on_shutdown(self, application: Application):
+        """Закрытие пула соединений с API и реестра при остановке"""
+        STARTUP.set_ready(False)
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            self._warmup_task = None
+        await self.live_views.close()
+        await self.clip_sender.close()
+        await self.api_client.close()
+        await self.registry.close()
+        await self.call_sessions.close()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+            self._metrics_server = None
         
     def setup_handlers(self):
         """Настройка обработчиков команд"""
@@ -41,6 +305,7 @@ class DomophoneBot:
         self.app.add_handler(CommandHandler("help", self.help_command))
         self.app.add_handler(CommandHandler("domofons", self.show_domofons))
         self.app.add_handler(CommandHandler("apartments", self.show_apartments))
+        self.app.add_handler(CommandHandler("status", self.status_command))
         self.app.add_handler(MessageHandler(filters.CONTACT, self.handle_contact))
         self.app.add_handler(MessageHandler(
             filters.TEXT & ~filters.COMMAND,
@@ -51,7 +316,7 @@ class DomophoneBot:
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка команды /start"""
         user_id = update.effective_user.id
-        logger.info(f"Пользователь начал общение с ботом. Chat ID: {user_id}")
+        logger.info("Пользователь начал общение с ботом. Chat ID: %s", user_id)
         
         if 'tenant_id' not in context.user_data:
             keyboard = [[{"text": "Отправить номер телефона", "request_contact": True}]]
@@ -77,6 +342,7 @@ class DomophoneBot:
 /help - Показать эту справку
 /domofons - Показать список доступных домофонов
 /apartments - Показать список квартир
+/status - Состояние домофонов (для администраторов)
 
 *Возможности:*
 • 📱 Авторизация по номеру телефона
@@ -105,52 +371,42 @@ class DomophoneBot:
             if phone.startswith('8'):
                 phone = '7' + phone[1:]
             
-            logger.info(f"Получен номер телефона: {phone}")
+            logger.info("Получен номер телефона: %s", phone)
             
             # Валидация номера телефона
             if not phone.isdigit() or len(phone) != 11:
                 await update.message.reply_text("❌ Неверный формат номера телефона")
                 return
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                headers = {
-                    "x-api-key": settings.API_TOKEN,
-                    "Content-Type": "application/json"
-                }
-                
-                url = f"{settings.API_URL}/check-tenant"
-                payload = {"phone": int(phone)}  # Преобразуем в int согласно API
-                
-                logger.info(f"Отправляем запрос: URL={url}, payload={payload}")
-                
-                response = await client.post(
-                    url,
-                    headers=headers,
-                    json=payload
+            logger.debug("Отправляем запрос check-tenant для телефона %s", phone)
+
+            try:
+                profile = await self.api_client.get_tenant_by_phone(int(phone))  # Преобразуем в int согласно API
+            except ApiClientError as e:
+                if e.status_code == 422:
+                    await update.message.reply_text(f"❌ Ошибка валидации: {e.detail_message}")
+                    return
+                raise
+
+            tenant_id = profile.tenant_id
+            if tenant_id is not None:
+                context.user_data['tenant_id'] = tenant_id
+                await self.registry.upsert(TenantRecord(
+                    tenant_id=tenant_id,
+                    phone=phone,
+                    chat_id=str(update.effective_chat.id),
+                    name=profile.name,
+                    is_super_user=profile.is_super_user
+                ))
+                self.api_client.tenant_cache.invalidate(tenant_id)
+                await self.show_main_menu(update, context)
+            else:
+                await update.message.reply_text(
+                    "❌ Не удалось получить ID пользователя"
                 )
-                
-                logger.info(f"Статус ответа: {response.status_code}")
-                logger.info(f"Тело ответа: {response.text}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    tenant_id = data.get('tenant_id')
-                    if tenant_id is not None:
-                        context.user_data['tenant_id'] = tenant_id
-                        await self.show_main_menu(update, context)
-                    else:
-                        await update.message.reply_text(
-                            "❌ Не удалось получить ID пользователя"
-                        )
-                elif response.status_code == 422:
-                    error_data = response.json()
-                    error_msg = error_data.get('detail', [{'msg': 'Неизвестная ошибка'}])[0].get('msg')
-                    await update.message.reply_text(f"❌ Ошибка валидации: {error_msg}")
-                else:
-                    raise HTTPException(status_code=response.status_code, detail=response.text)
 
         except Exception as e:
-            logger.error(f"Ошибка при обработке контакта: {str(e)}")
+            logger.error("Ошибка при обработке контакта: %s", e)
             await update.message.reply_text(
                 "❌ Ошибка авторизации. Попробуйте позже или обратитесь в поддержку."
             )
@@ -164,102 +420,95 @@ class DomophoneBot:
             return
         
         try:
-            headers = {
-                "x-api-key": settings.API_TOKEN,
-                "Content-Type": "application/json",
-                "accept": "application/json"
-            }
-            
             tenant_id = context.user_data['tenant_id']
-            apartments_url = f"{settings.API_URL}/domo.apartment"
-            
-            async with httpx.AsyncClient() as client:
-                logger.info(f"Запрос квартир для tenant_id={tenant_id}")
-                apartments_response = await client.get(
-                    apartments_url,
-                    headers=headers,
-                    params={"tenant_id": tenant_id}
+            logger.info("Запрос квартир для tenant_id=%s", tenant_id)
+
+            try:
+                apartments, digest = await self.api_client.get_apartments_versioned(tenant_id)
+            except ApiClientError as e:
+                if e.status_code == 422:
+                    await update.message.reply_text(f"❌ Ошибка валидации: {e.detail_message}")
+                    return
+                raise
+
+            if not apartments:
+                await update.message.reply_text("У вас нет доступных квартир")
+                return
+
+            # Сообщение пересобирается, только если изменился ответ API
+            cached = self._apartments_messages.get(tenant_id)
+            if cached is not None and cached[0] == digest:
+                messages = cached[1]
+            else:
+                messages = render_apartments(apartments)
+                self._apartments_messages.set(tenant_id, (digest, messages))
+
+            for message_text in messages:
+                await update.message.reply_text(
+                    message_text,
+                    parse_mode='Markdown',
+                    disable_web_page_preview=True
                 )
-                
-                logger.info(f"Статус ответа: {apartments_response.status_code}")
-                logger.info(f"Тело ответа: {apartments_response.text}")
-                
-                if apartments_response.status_code == 200:
-                    apartments = apartments_response.json()
-                    if not apartments:
-                        await update.message.reply_text("У вас нет доступных квартир")
-                        return
-                        
-                    # Формируем сообщение со списком квартир
-                    message_text = "🏘 *Информация о ваших квартирах*\n\n"
-                    for idx, apartment in enumerate(apartments, 1):
-                        location = apartment.get('location', {})
-                        address = location.get('readable_address', 'Адрес не указан')
-                        apartment_number = location.get('apartments_number', '')
-                        paid_before = apartment.get('paid_before', '')
-                        
-                        message_text += f"*Квартира #{idx}*\n"
-                        message_text += f"📍 Адрес: `{address}`\n"
-                        if apartment_number:
-                            message_text += f"🚪 Номер квартиры: `{apartment_number}`\n"
-                        if paid_before:
-                            message_text += f"💳 Оплачено до: `{paid_before}`\n"
-                        
-                        # Добавляем информацию о жильцах
-                        tenants = apartment.get('tenants', [])
-                        if tenants:
-                            message_text += "\n👥 *Жильцы:*\n"
-                            
-                            for tenant in tenants:
-                                name = tenant.get('name', '').strip()
-                                phone = tenant.get('phone', '')
-                                status = tenant.get('status', {})
-                                role = status.get('role', 0)
-                                
-                                # Форматируем номер телефона
-                                if phone and len(phone) == 11:
-                                    formatted_phone = f"+{phone[0]} ({phone[1:4]}) {phone[4:7]}-{phone[7:9]}-{phone[9:]}"
-                                else:
-                                    formatted_phone = phone
-                                    
-                                # Добавляем роль жильца
-                                role_text = "👑 Владелец" if role == 1 else "👤 Жилец"
-                                
-                                message_text += f"• {name} ({role_text})\n"
-                                message_text += f"  📱 `{formatted_phone}`\n"
-                        
-                        message_text += "\n" + "─" * 30 + "\n\n"
-                    
-                    # Добавляем информацию о командах
-                    message_text += (
-                        "*Доступные команды:*\n"
-                        "📱 /domofons - Управление домофонами\n"
-                        "ℹ️ /help - Справка по командам\n"
-                    )
-                    
-                    # Отправляем информацию о квартирах
-                    await update.message.reply_text(
-                        message_text,
-                        parse_mode='Markdown',
-                        disable_web_page_preview=True
-                    )
-                        
-                elif apartments_response.status_code == 422:
-                    error_data = apartments_response.json()
-                    error_msg = error_data.get('detail', [{'msg': 'Неизвестная ошибка'}])[0].get('msg')
-                    await update.message.reply_text(f"❌ Ошибка валидации: {error_msg}")
-                else:
-                    raise HTTPException(
-                        status_code=apartments_response.status_code,
-                        detail=apartments_response.text
-                    )
-                    
+
         except Exception as e:
-            logger.error(f"Ошибка получения списка квартир: {str(e)}")
+            logger.error("Ошибка получения списка квартир: %s", e)
             await update.message.reply_text(
                 "❌ Ошибка получения списка. Попробуйте позже или обратитесь в поддержку."
             )
 
+    async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводка по домофонам для суперпользователей"""
+        tenant_id = context.user_data.get('tenant_id')
+        if not tenant_id:
+            await update.message.reply_text(
+                "❌ Вы не авторизованы. Используйте /start для авторизации."
+            )
+            return
+        if not self.registry.is_super_user(tenant_id):
+            await update.message.reply_text("⛔️ Команда доступна только администраторам")
+            return
+
+        message = await update.message.reply_text("📊 Проверяю домофоны…")
+        # Сбор идёт до STATUS_DEADLINE секунд - обработчик его не ждёт
+        context.application.create_task(self._show_status(message, tenant_id), update=update)
+
+    async def _show_status(self, message: Message, tenant_id: int, page: int = 0):
+        """Сбор сводки и показ её страницы в message"""
+        try:
+            report = await self._status_flight.do(
+                tenant_id,
+                lambda: collect_status(self.api_client, self.call_sessions, tenant_id, self.status_config)
+            )
+        except (ApiClientError, asyncio.TimeoutError) as e:
+            logger.warning("Не удалось собрать сводку для %s: %s", tenant_id, e)
+            await message.edit_text("❌ Не удалось получить список домофонов. Попробуйте позже.")
+            return
+        pages = render_status(report, self.status_config.page_size)
+        self._status_pages.set((message.chat_id, message.message_id), pages)
+        await self._show_status_page(message, pages, page)
+
+    async def _show_status_page(self, message: Message, pages: List[str], page: int):
+        page = min(page, len(pages) - 1)
+        try:
+            await message.edit_text(pages[page], parse_mode='Markdown', reply_markup=status_keyboard(page, len(pages)))
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+
+    async def _status_callback(self, query, action: str, page: int, tenant_id: int, context: ContextTypes.DEFAULT_TYPE):
+        """Листание и обновление сводки /status"""
+        if not self.registry.is_super_user(tenant_id):
+            await query.answer("⛔️ Доступно только администраторам", show_alert=True)
+            return
+        message = query.message
+        pages = self._status_pages.get((message.chat_id, message.message_id))
+        if action == "statusrefresh" or pages is None:
+            await query.answer("🔄 Обновляю сводку…")
+            context.application.create_task(self._show_status(message, tenant_id, page))
+            return
+        await query.answer()
+        await self._show_status_page(message, pages, page)
+
     async def show_domofons(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показ списка доступных домофонов"""
         if 'tenant_id' not in context.user_data:
@@ -269,215 +518,341 @@ class DomophoneBot:
             return
         
         try:
-            headers = {
-                "x-api-key": settings.API_TOKEN,
-                "Content-Type": "application/json"
-            }
-            
             tenant_id = context.user_data['tenant_id']
-            apartments_url = f"{settings.API_URL}/domo.apartment"
-            
-            async with httpx.AsyncClient() as client:
-                apartments_response = await client.get(
-                    apartments_url,
-                    headers=headers,
-                    params={"tenant_id": tenant_id}
+            resolved, reply_markup = await self._domofons_cache.get(
+                tenant_id,
+                lambda: self._load_domofons_keyboard(tenant_id)
+            )
+            if not resolved:
+                await update.message.reply_text("❌ У вас нет доступных квартир")
+                return
+
+            if reply_markup:
+                await update.message.reply_text(
+                    "🏠 Доступные домофоны:",
+                    reply_markup=reply_markup,
+                    parse_mode='Markdown'
                 )
-                
-                if apartments_response.status_code != 200:
-                    raise HTTPException(
-                        status_code=apartments_response.status_code,
-                        detail=apartments_response.text
-                    )
-                
-                apartments = apartments_response.json()
-                if not apartments:
-                    await update.message.reply_text("❌ У вас нет доступных квартир")
-                    return
-                    
-                keyboard = []
-                
-                for apartment in apartments:
-                    apartment_id = apartment.get('id')
-                    if apartment_id:
-                        domofons_url = f"{settings.API_URL}/domo.apartment/{apartment_id}/domofon"
-                        domofons_response = await client.get(
-                            domofons_url,
-                            headers=headers,
-                            params={"tenant_id": tenant_id}
-                        )
-                        
-                        if domofons_response.status_code == 200:
-                            domofons = domofons_response.json()
-                            for domofon in domofons:
-                                domofon_id = domofon.get('id')
-                                name = domofon.get('name', '')
-                                
-                                # Проверяем, является ли домофон консьержем
-                                if "консьерж" in name.lower():
-                                    keyboard.append([
-                                        InlineKeyboardButton(
-                                            f"📷 Камера {name}",
-                                            callback_data=f"snapshot_{domofon_id}"
-                                        )
-                                    ])
-                                else:
-                                    keyboard.append([
-                                        InlineKeyboardButton(
-                                            f"📷 Камера {name}",
-                                            callback_data=f"snapshot_{domofon_id}"
-                                        ),
-                                        InlineKeyboardButton(
-                                            f"🔓 Открыть",
-                                            callback_data=f"open_{domofon_id}"
-                                        )
-                                    ])
-                
-                if keyboard:
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
-                        "🏠 Доступные домофоны:",
-                        reply_markup=reply_markup,
-                        parse_mode='Markdown'
-                    )
-                else:
-                    await update.message.reply_text(
-                        "❌ Не найдено доступных домофонов для ваших квартир"
-                    )
-                    
+            else:
+                await update.message.reply_text(
+                    "❌ Не найдено доступных домофонов для ваших квартир"
+                )
+
         except Exception as e:
-            logger.error(f"Ошибка получения списка домофонов: {str(e)}")
+            logger.error("Ошибка получения списка домофонов: %s", e)
             await update.message.reply_text(
                 "❌ Ошибка получения списка. Попробуйте позже или обратитесь в поддержку."
             )
 
+    async def _load_domofons_keyboard(self, tenant_id: int):
+        """Получение домофонов пользователя и построение клавиатуры для них"""
+        resolved = await self.api_client.resolve_domofons(tenant_id)
+        keyboard = []
+
+        for apartment, domofons in resolved:
+            for domofon in domofons:
+                row = [
+                    InlineKeyboardButton(
+                        f"📷 Камера {domofon.name}",
+                        callback_data=f"live_{domofon.id}"
+                    )
+                ]
+                if self.clip_sender.config.enabled:
+                    row.append(InlineKeyboardButton("🎥 Видео", callback_data=f"video_{domofon.id}"))
+                # Консьерж дверь не открывает
+                if not domofon.is_concierge:
+                    row.append(InlineKeyboardButton("🔓 Открыть", callback_data=f"open_{domofon.id}"))
+                keyboard.append(row)
+
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        return resolved, reply_markup
+
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка нажатий на кнопки"""
+        # Ответы на нажатия отправляются раньше информационных сообщений
+        with outbound_priority(Priority.ACTION):
+            await self._process_callback(update, context)
+
+    async def _process_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Нажатие подтверждается сразу, результат появляется в том же сообщении"""
+        query = update.callback_query
+        answered = False
         try:
-            query = update.callback_query
-            data_parts = query.data.split('_')
-            action = data_parts[0]
-            domofon_id = int(data_parts[1])
-            
+            action, _, argument = query.data.partition('_')
+
             tenant_id = context.user_data.get('tenant_id')
             if not tenant_id:
-                await query.message.reply_text("❌ Ошибка: пользователь не авторизован")
-                await query.answer()
+                await query.answer("❌ Вы не авторизованы. Используйте /start", show_alert=True)
                 return
 
+            if action in ("status", "statusrefresh"):
+                await self._status_callback(query, action, int(argument), tenant_id, context)
+                return
+
+            # Кнопки уведомлений о вызове несут id сессии вызова, остальные - id домофона
+            session = None
+            if action in ("callopen", "callignore"):
+                session = await self.call_sessions.get(argument)
+                if session is None or not session.active:
+                    # Вызов завершён: к API не обращаемся
+                    await self._reject_stale_press(query, session)
+                    return
+                domofon_id = session.domofon_id
+            else:
+                domofon_id = int(argument)
+
             if action == "snapshot":
-                # Получение снимка  камеры
-                url = f"{settings.API_URL}/domo.domofon/urlsOnType"
-                
-                headers = {
-                    "X-API-KEY": settings.API_TOKEN,
-                    "Content-Type": "application/json",
-                    "accept": "application/json"
-                }
-                
-                payload = {
-                    "intercoms_id": [domofon_id],
-                    "media_type": ["JPEG"]
-                }
-                params = {"tenant_id": tenant_id}
-                
-                async with httpx.AsyncClient() as client:
-                    try:
-                        response = await client.post(
-                            url,
-                            headers=headers,
-                            json=payload,
-                            params=params
-                        )
-                        
-                        logger.info(f"Ответ сервера: {response.status_code} - {response.text}")
-                        
-                        if response.status_code == 200:
-                            data = response.json()
-                            if data and len(data) > 0:
-                                jpeg_url = data[0].get('jpeg')
-                                if jpeg_url:
-                                    await query.message.reply_photo(
-                                        photo=jpeg_url,
-                                        caption="📷 Снимок с камеры"
-                                    )
-                                else:
-                                    await query.message.reply_text("❌ Ссылка на снимок отсутствует")
-                            else:
-                                await query.message.reply_text("❌ Нет данных от камеры")
-                        else:
-                            await query.message.reply_text(f"❌ Ошибка получения снимка: {response.text}")
-                            
-                    except httpx.RequestError as e:
-                        logger.error(f"Ошибка запроса: {str(e)}")
-                        await query.message.reply_text("❌ Ошибка соединения с сервером")
-                    
-            elif action == "open":
-                url = f"{settings.API_URL}/domo.domofon/{domofon_id}/open"
-                
-                headers = {
-                    "X-API-KEY": settings.API_TOKEN,
-                    "Content-Type": "application/json",
-                    "accept": "application/json"
-                }
-                
-                payload = {"door_id": 0}
-                params = {"tenant_id": tenant_id}
-                
-                async with httpx.AsyncClient() as client:
+                await query.answer("📷 Получаю снимок…")
+                answered = True
+                await self._run_with_placeholder(
+                    query, self._send_snapshot(query, domofon_id, tenant_id), "📷 Получаю снимок…"
+                )
+
+            elif action == "live":
+                answered = await self._start_live_view(query, domofon_id, tenant_id)
+
+            elif action == "liverefresh":
+                view = self.live_views.get(query.message.chat_id, query.message.message_id)
+                if view is None:
+                    # Трансляция уже закончилась - запускаем заново в том же сообщении
+                    answered = await self._start_live_view(query, domofon_id, tenant_id)
+                elif self.live_views.throttled(view.chat_id):
+                    await query.answer("⏳ Снимок обновляется, подождите")
+                else:
+                    self.live_views.refresh(view)
+                    await query.answer("🔄 Обновляю…")
+
+            elif action == "livestop":
+                await query.answer("⏹ Трансляция остановлена")
+                answered = True
+                if self.live_views.get(query.message.chat_id, query.message.message_id) is not None:
+                    await self.live_views.stop(query.get_bot(), query.message.chat_id)
+                else:
+                    await query.edit_message_reply_markup(reply_markup=stopped_keyboard(domofon_id))
+
+            elif action == "video":
+                if not self.clip_sender.accepting:
+                    self.clip_sender.reject()
+                    await query.answer("⏳ Сейчас отправляется много видео, попробуйте позже")
+                    return
+                await query.answer("🎥 Записываю видео…")
+                answered = True
+                await self._set_status(query, "🎥 Записываю видео…")
+                # Загрузка видео долгая - обработчик не ждёт её
+                self.clip_sender.submit(self._send_clip(query, domofon_id, tenant_id))
+
+            elif action in ("open", "callopen"):
+                if self.api_client.open_pending(domofon_id, tenant_id):
+                    # Повторное нажатие ждёт результата первого, сообщение правит первое
                     try:
-                        response = await client.post(
-                            url,
-                            headers=headers,
-                            json=payload,
-                            params=params
-                        )
-                        
-                        logger.info(f"Ответ сервера: {response.status_code} - {response.text}")
-                        
-                        if response.status_code == 200:
-                            success_message = (
-                                "✅ *Дверь успешно открыта*\n\n"
-                                "🕐 Время: {}\n"
-                                "🚪 Домофон: #{}\n"
-                                "📍 Статус: Успешно\n\n"
-                                "_Дверь будет открыта в течение нескольких секунд_"
-                            ).format(
-                                datetime.now().strftime("%H:%M:%S"),
-                                domofon_id
-                            )
-                            await query.message.reply_text(
-                                success_message,
-                                parse_mode='Markdown'
-                            )
-                        elif response.status_code == 422:
-                            error_data = response.json()
-                            error_msg = error_data.get('detail', ['Ошибка валидации'])[0].get('msg', 'Неизвестная ошибка')
-                            await query.message.reply_text(f"❌ Ошибка: {error_msg}")
-                        else:
-                            await query.message.reply_text(f"❌ Ошибка сервера: {response.text}")
-                            
-                    except httpx.RequestError as e:
-                        logger.error(f"Ошибка запроса: {str(e)}")
-                        await query.message.reply_text("❌ Ошибка соединения с сервером")
-        
-            await query.answer()
-                    
+                        await self.api_client.open_domofon_once(domofon_id, tenant_id)
+                    except ApiClientError:
+                        await query.answer("❌ Не удалось открыть дверь")
+                        return
+                    await query.answer("✅ Дверь открыта")
+                    return
+                await query.answer("🔓 Открываю…")
+                answered = True
+                await self._run_with_placeholder(
+                    query, self._open_door(query, domofon_id, tenant_id, session), "🔓 Открываю дверь…"
+                )
+
+            elif action == "callignore":
+                message = query.message
+                if not await self.call_sessions.resolve(session.session_id, IGNORED, message.chat_id, message.message_id):
+                    await self._reject_stale_press(query, None)
+                    return
+                await query.answer("⛔️ Дверь не будет открыта")
+                answered = True
+                await self._set_status(query, "⛔️ Вызов отклонён", reply_markup=None)
+
+            else:
+                # «Не открывать» в уведомлениях без сессии вызова
+                await query.answer("⛔️ Дверь не будет открыта" if action == "ignore" else None)
+
         except Exception as e:
-            logger.error(f"Ошибка при обработке callback: {str(e)}", exc_info=True)
-            await query.message.reply_text("❌ Произошла ошибка")
-            await query.answer()
+            logger.error("Ошибка при обработке callback: %s", e, exc_info=True)
+            if answered:
+                await self._set_status(query, "❌ Произошла ошибка")
+            else:
+                await query.answer("❌ Произошла ошибка")
 
-    async def check_api(self):
-        """Проверка доступности API"""
+    async def _run_with_placeholder(self, query, work: Awaitable[Any], placeholder: str):
+        """Выполнение work; если оно дольше callback_placeholder_delay, в сообщении появляется placeholder.
+
+        Правки сообщения из work ждут правки с заглушкой (_before_result_edit),
+        поэтому заглушка не может прийти позже результата.
+        """
+        state = _PlaceholderState()
+        token = _placeholder.set(state)
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"{API_URL}/")
-                response.raise_for_status()
-        except Exception as e:
-            logger.error(f"API недоступен: {str(e)}")
+            # Задача получает копию контекста с state
+            task = asyncio.ensure_future(work)
+        finally:
+            _placeholder.reset(token)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.callback_placeholder_delay)
+            if not done and not state.result_started:
+                state.edit = asyncio.ensure_future(self._set_status(query, placeholder))
+                await state.edit
+            return await task
+        except asyncio.CancelledError:
+            task.cancel()
             raise
 
+    async def _reject_stale_press(self, query, session: Optional[CallSession]):
+        """Ответ на нажатие в уведомлении о завершённом вызове и снятие его кнопок"""
+        self.call_sessions.reject()
+        state = session.state if session else None
+        await query.answer({
+            OPENED: "✅ Дверь уже открыта",
+            IGNORED: "⛔️ Вызов уже отклонён"
+        }.get(state, "⌛ Вызов уже завершён"))
+        try:
+            await query.edit_message_reply_markup(reply_markup=None)
+        except BadRequest as e:
+            logger.debug("Не удалось убрать кнопки уведомления: %s", e)
+
+    async def _set_status(self, query, status: str, reply_markup: Any = _KEEP_MARKUP):
+        """Замена строки статуса в сообщении с кнопками; при неудаче - новое сообщение.
+
+        reply_markup=None убирает кнопки, по умолчанию они остаются.
+        """
+        await _before_result_edit()
+        message = query.message
+        if reply_markup is _KEEP_MARKUP:
+            reply_markup = message.reply_markup
+        try:
+            if message.photo:
+                await query.edit_message_caption(
+                    caption=with_status(_message_markdown(message), status),
+                    parse_mode='Markdown',
+                    reply_markup=reply_markup
+                )
+            else:
+                await query.edit_message_text(
+                    with_status(_message_markdown(message), status),
+                    parse_mode='Markdown',
+                    reply_markup=reply_markup
+                )
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                return
+            # Сообщение слишком старое или удалено
+            logger.debug("Не удалось изменить сообщение: %s", e)
+            await message.reply_text(status, parse_mode='Markdown')
+
+    async def _start_live_view(self, query, domofon_id: int, tenant_id: int) -> bool:
+        """Трансляция с камеры в одном сообщении со снимком.
+
+        Из списка домофонов приходит новое сообщение, в сообщении со
+        снимком трансляция идёт на месте. Если трансляции выключены или
+        их слишком много, отправляется один снимок. False - нажатие
+        отклонено как слишком частое.
+        """
+        message = query.message
+        if self.live_views.throttled(message.chat_id):
+            await query.answer("⏳ Камера уже включается, подождите")
+            return False
+
+        if not self.live_views.can_start(message.chat_id):
+            await query.answer("📷 Получаю снимок…")
+            await self._run_with_placeholder(
+                query, self._send_snapshot(query, domofon_id, tenant_id), "📷 Получаю снимок…"
+            )
+            return True
+
+        await query.answer("📷 Включаю камеру…")
+        try:
+            view = await self.live_views.start(
+                query.get_bot(),
+                message.chat_id,
+                domofon_id,
+                tenant_id,
+                message_id=message.message_id if message.photo else None
+            )
+            if view is None:
+                await self._set_status(query, "❌ Нет данных от камеры")
+        except ApiClientError as e:
+            await self._set_status(query, media_error_status(e))
+        return True
+
+    async def _send_snapshot(self, query, domofon_id: int, tenant_id: int):
+        """Снимок заменяет фото в сообщении с кнопками или приходит отдельным сообщением"""
+        message = query.message
+        try:
+            snapshot = await self.snapshot_cache.prepare(domofon_id, tenant_id)
+            if not snapshot:
+                await self._set_status(query, "❌ Нет данных от камеры")
+                return
+
+            now = datetime.now().strftime("%H:%M:%S")
+            await _before_result_edit()
+            if message.photo:
+                caption = with_status(_message_markdown(message), f"📷 Снимок обновлён в {now}")
+                await self.snapshot_cache.send(domofon_id, snapshot, lambda photo: query.edit_message_media(
+                    InputMediaPhoto(media=photo, caption=caption, parse_mode='Markdown'),
+                    reply_markup=message.reply_markup
+                ))
+            else:
+                # Текстовое сообщение нельзя превратить в фото; следующие
+                # обновления этого снимка будут идти на месте
+                await self.snapshot_cache.send(domofon_id, snapshot, lambda photo: message.reply_photo(
+                    photo=photo,
+                    caption=f"📷 Снимок с камеры\n🕐 {now}",
+                    reply_markup=InlineKeyboardMarkup([[
+                        InlineKeyboardButton("🔄 Обновить", callback_data=f"snapshot_{domofon_id}")
+                    ]])
+                ))
+        except ApiClientError as e:
+            await self._set_status(query, media_error_status(e))
+
+    async def _send_clip(self, query, domofon_id: int, tenant_id: int):
+        """Видео с камеры отдельным сообщением (выполняется в фоне)"""
+        message = query.message
+        try:
+            sent = await self.clip_sender.send(domofon_id, tenant_id, lambda video, thumbnail: message.reply_video(
+                video=video,
+                thumbnail=thumbnail,
+                caption=f"🎥 Видео с камеры\n🕐 {datetime.now().strftime('%H:%M:%S')}",
+                supports_streaming=True,
+                write_timeout=self.clip_sender.config.upload_timeout
+            ))
+            await self._set_status(query, "🎥 Видео отправлено" if sent else "❌ Камера не отдаёт видео")
+        except MediaLimitError as e:
+            logger.info("Видео домофона %s не отправлено: %s", domofon_id, e)
+            await self._set_status(query, "❌ Видео слишком большое или загружается слишком долго")
+        except ApiClientError as e:
+            await self._set_status(query, media_error_status(e, "видео"))
+        except Exception as e:
+            logger.error("Ошибка отправки видео домофона %s: %s", domofon_id, e, exc_info=True)
+            await self._set_status(query, "❌ Не удалось отправить видео")
+
+    async def _open_door(self, query, domofon_id: int, tenant_id: int, session: Optional[CallSession] = None):
+        """Открытие двери; в уведомлении о вызове после успеха кнопки убираются"""
+        try:
+            await self.api_client.open_domofon_once(domofon_id, tenant_id)
+            reply_markup = _KEEP_MARKUP
+            if session is not None:
+                message = query.message
+                await self.call_sessions.resolve(session.session_id, OPENED, message.chat_id, message.message_id)
+                reply_markup = None
+            await self._set_status(query, (
+                "✅ *Дверь успешно открыта*\n"
+                "🕐 Время: {}\n"
+                "🚪 Домофон: #{}"
+            ).format(
+                datetime.now().strftime("%H:%M:%S"),
+                domofon_id
+            ), reply_markup=reply_markup)
+        except ApiClientError as e:
+            if e.status_code is None:
+                await self._set_status(query, "❌ Ошибка соединения с сервером")
+            elif e.status_code == 422:
+                await self._set_status(query, f"❌ Ошибка: {escape_markdown(e.detail_message)}")
+            else:
+                await self._set_status(query, f"❌ Ошибка сервера: {escape_markdown(e.detail_message)}")
+
     async def show_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показ главного меню с кнопками"""
         keyboard = [
@@ -503,6 +878,29 @@ class DomophoneBot:
         """Запуск бота"""
         self.app.run_polling()
 
+    async def start_webhook(self, url: Optional[str] = None, secret_token: Optional[str] = None):
+        """Запуск обработки обновлений, которые передаёт ASGI-приложение"""
+        await self.app.initialize()
+        # post_init вызывается только из run_polling/run_webhook
+        await self._on_startup(self.app)
+        await self.app.start()
+        if url:
+            await self.app.bot.set_webhook(url=url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+            logger.info("Вебхук Telegram установлен: %s", url)
+
+    async def stop_webhook(self):
+        """Остановка обработки обновлений (ресурсы освобождает shutdown_webhook)"""
+        if self.app.running:
+            await self.app.stop()
+
+    async def shutdown_webhook(self):
+        await self.app.shutdown()
+        await self._on_shutdown(self.app)
+
+    async def process_webhook_update(self, data: Dict[str, Any]):
+        """Постановка обновления из вебхука Telegram в очередь Application"""
+        await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+
 if __name__ == '__main__':
     bot = DomophoneBot()
     bot.run() 
\ No newline at end of file
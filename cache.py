@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """LRU-кэш в памяти с ограничением по размеру и времени жизни записей.
+
+    Если задан weigher, дополнительно ограничивается суммарный вес записей
+    (например, размер в байтах) значением max_weight.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        weigher: Optional[Callable[[Any], int]] = None,
+        max_weight: Optional[int] = None
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigher = weigher
+        self.max_weight = max_weight
+        self.weight = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        """Значение по ключу или default, если записи нет или она устарела"""
+        entry = self._data.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+
+        value, expires_at, weight = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            if count:
+                self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохранение значения с вытеснением самых старых записей"""
+        self._remove(key)
+        weight = self.weigher(value) if self.weigher else 0
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), weight)
+        self.weight += weight
+        while len(self._data) > self.maxsize or (
+            self.max_weight is not None and self.weight > self.max_weight and len(self._data) > 1
+        ):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def invalidate(self, key: Hashable):
+        self._remove(key)
+
+    def clear(self):
+        self._data.clear()
+        self.weight = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'weight': self.weight,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0
+        }
+
+class SingleFlight:
+    """Объединение одновременных вызовов с одинаковым ключом в один запрос"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Выполнение fn один раз для всех одновременных вызовов с ключом key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного из ожидающих не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+class SWRCache:
+    """Кэш, отдающий устаревшие данные на время фонового обновления (stale-while-revalidate)"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, stale_ttl: float = 600.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl + stale_ttl)
+        self._flight = SingleFlight()
+        self._background: set = set()
+        self.stale_hits = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Значение из кэша; устаревшее значение отдаётся сразу и обновляется в фоне"""
+        entry = self._cache.get(key)
+        if entry is not None:
+            value, fresh_until = entry
+            if fresh_until <= time.monotonic():
+                self.stale_hits += 1
+                self._refresh_in_background(key, loader)
+            return value
+        return await self._flight.do(key, lambda: self._load(key, loader))
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = await loader()
+        self._cache.set(key, (value, time.monotonic() + self.ttl))
+        return value
+
+    def _refresh_in_background(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        if key in self._flight:
+            return
+        task = asyncio.ensure_future(self._flight.do(key, lambda: self._load(key, loader)))
+        self._background.add(task)
+        task.add_done_callback(self._on_refreshed)
+
+    def _on_refreshed(self, task: asyncio.Future):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Не удалось обновить данные кэша в фоне: %s", task.exception())
+
+    def invalidate(self, key: Hashable):
+        self._cache.invalidate(key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats['stale_hits'] = self.stale_hits
+        stats['coalesced'] = self._flight.coalesced
+        return stats
@@ -0,0 +1,130 @@
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('reject', 'drop_oldest', 'block')
+
+@dataclass
+class CallEvent:
+    domofon_id: int
+    tenant_id: int
+    event_id: Optional[str] = None
+    received_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def dedupe_key(self):
+        return (self.domofon_id, self.tenant_id, self.event_id)
+
+class CallDispatcher:
+    """Ограниченная очередь входящих вызовов с пулом обработчиков.
+
+    Политика переполнения:
+    - reject: новый вызов отклоняется;
+    - drop_oldest: из очереди вытесняется самый старый вызов;
+    - block: приём ждёт освобождения места в очереди.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[CallEvent], Awaitable[Any]],
+        max_size: int = 1000,
+        workers: int = 4,
+        overflow: str = 'reject',
+        drain_timeout: float = 10.0
+    ):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения очереди: {overflow}")
+        self._handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        self.overflow = overflow
+        self.drain_timeout = drain_timeout
+        self._queue: "asyncio.Queue[CallEvent]" = None
+        self._tasks: List[asyncio.Task] = []
+        self._accepting = False
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Запуск обработчиков очереди"""
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"call-worker-{i}")
+            for i in range(self.workers)
+        ]
+        self._accepting = True
+        logger.info("Очередь вызовов запущена: workers=%s, max_size=%s, overflow=%s", self.workers, self.max_size, self.overflow)
+
+    async def submit(self, event: CallEvent) -> bool:
+        """Постановка вызова в очередь. Возвращает False, если вызов не принят"""
+        if not self._accepting:
+            self.rejected += 1
+            return False
+
+        if self.overflow == 'block':
+            await self._queue.put(event)
+            return True
+
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            if self.overflow == 'reject':
+                self.rejected += 1
+                logger.warning("Очередь вызовов переполнена, вызов домофона %s отклонён", event.domofon_id)
+                return False
+
+        dropped = self._queue.get_nowait()
+        self._queue.task_done()
+        self.dropped += 1
+        logger.warning("Очередь вызовов переполнена, вытеснен вызов домофона %s", dropped.domofon_id)
+        self._queue.put_nowait(event)
+        return True
+
+    async def stop(self):
+        """Остановка приёма и дообработка очереди в пределах drain_timeout"""
+        if self._queue is None:
+            return
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Очередь вызовов не разобрана за %s с, осталось %s", self.drain_timeout, self.depth)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Очередь вызовов остановлена")
+
+    async def _worker(self, index: int):
+        while True:
+            event = await self._queue.get()
+            try:
+                await self._handler(event)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error("❌ Ошибка обработки вызова домофона %s: %s", event.domofon_id, e)
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'depth': self.depth,
+            'max_size': self.max_size,
+            'workers': self.workers,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'dropped': self.dropped
+        }
@@ -0,0 +1,237 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import secrets
+import time
+
+from cache import TTLCache
+import db
+
+logger = logging.getLogger(__name__)
+
+RINGING = 'ringing'
+OPENED = 'opened'
+IGNORED = 'ignored'
+
+@dataclass
+class CallSessionConfig:
+    # Сколько секунд кнопки уведомления о вызове остаются рабочими
+    ttl: float = 120.0
+    max_entries: int = 10000
+    sweep_interval: float = 10.0
+    sweep_batch: int = 100
+    # Сколько секунд завершённые вызовы хранятся для статистики (/status)
+    retention: float = 86400.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            ttl=float(os.getenv('CALL_SESSION_TTL', cls.ttl)),
+            max_entries=int(os.getenv('CALL_SESSION_MAX_ENTRIES', cls.max_entries)),
+            sweep_interval=float(os.getenv('CALL_SESSION_SWEEP_INTERVAL', cls.sweep_interval)),
+            sweep_batch=int(os.getenv('CALL_SESSION_SWEEP_BATCH', cls.sweep_batch)),
+            retention=float(os.getenv('CALL_SESSION_RETENTION', cls.retention))
+        )
+
+@dataclass
+class CallSession:
+    session_id: str
+    domofon_id: int
+    tenant_id: int
+    expires_at: float
+    state: str = RINGING
+
+    @property
+    def active(self) -> bool:
+        return self.state == RINGING and time.time() < self.expires_at
+
+class CallSessionStore:
+    """Сессии вызовов для кнопок уведомлений («Открыть», «Не открывать»).
+
+    Сессия создаётся сервером вебхуков на каждый вызов, её короткий id
+    передаётся в callback_data. Бот по нему узнаёт домофон и то, идёт ли
+    ещё вызов, поэтому нажатие на старое уведомление отклоняется без
+    запроса к API. Сессии лежат в domophone.db (бот и сервер вебхуков
+    могут быть разными процессами), свежие дублируются в ограниченном
+    кэше в памяти. Кэшу верим до истечения вызова: если вызов завершили
+    в другом процессе, это выяснит условный UPDATE в resolve(). Сообщения
+    с кнопками запоминаются, и sweep() убирает кнопки у уведомлений
+    завершённых и истёкших вызовов.
+    """
+
+    def __init__(self, path: Optional[str] = None, config: Optional[CallSessionConfig] = None):
+        self.path = path
+        self.config = config or CallSessionConfig()
+        self._conn = None
+        self._db_lock = asyncio.Lock()
+        self._cache = TTLCache(maxsize=self.config.max_entries, ttl=self.config.ttl)
+        self.rejected = 0
+
+    async def _execute(self, fn, *args):
+        async with self._db_lock:
+            if self._conn is None:
+                self._conn = await asyncio.to_thread(db.connect, self.path)
+            return await asyncio.to_thread(fn, self._conn, *args)
+
+    async def close(self):
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    async def create(self, domofon_id: int, tenant_id: int) -> CallSession:
+        """Новая сессия вызова с id для callback_data"""
+        session = CallSession(
+            session_id=secrets.token_urlsafe(6),
+            domofon_id=domofon_id,
+            tenant_id=tenant_id,
+            expires_at=time.time() + self.config.ttl
+        )
+        await self._execute(_insert_session, session)
+        self._cache.set(session.session_id, session)
+        return session
+
+    async def add_messages(self, session_id: str, messages: List[Tuple[str, int]]):
+        """Уведомления с кнопками сессии: (chat_id, message_id)"""
+        if messages:
+            await self._execute(_insert_messages, session_id, messages)
+
+    async def get(self, session_id: str) -> Optional[CallSession]:
+        """Сессия по id; None, если её нет (истекла и убрана или id чужой)"""
+        session = self._cache.get(session_id)
+        if session is None:
+            # Сессию создал другой процесс или она вытеснена из кэша
+            session = await self._execute(_select_session, session_id)
+            if session is not None:
+                self._cache.set(session_id, session)
+        return session
+
+    def reject(self):
+        """Учёт нажатия на кнопку завершённого вызова"""
+        self.rejected += 1
+
+    async def resolve(self, session_id: str, state: str, chat_id: str, message_id: Optional[int] = None) -> bool:
+        """Перевод идущего вызова в state; False, если вызов уже завершён или истёк.
+
+        Сообщение, в котором нажали кнопку, бот правит сам, и sweep() его
+        не трогает.
+        """
+        changed = await self._execute(_update_state, session_id, state, str(chat_id), message_id, time.time())
+        session = self._cache.get(session_id, count=False)
+        if changed and session is not None:
+            session.state = state
+        return changed
+
+    async def sweep(self, remove_keyboard) -> int:
+        """Снятие кнопок с уведомлений истёкших и завершённых вызовов.
+
+        remove_keyboard(chat_id, message_id) вызывается для каждого
+        сообщения; сообщения, с которых кнопки сняты, удаляются из базы, а
+        при ошибке остаются до следующего раза. Сессии без сообщений
+        удаляются по истечении retention. Возвращает число обработанных
+        сообщений.
+        """
+        messages = await self._execute(_select_stale_messages, time.time(), self.config.sweep_batch, self.config.retention)
+        if not messages:
+            return 0
+        results = await asyncio.gather(
+            *(remove_keyboard(chat_id, message_id) for _, chat_id, message_id in messages),
+            return_exceptions=True
+        )
+        done = [rowid for (rowid, _, _), result in zip(messages, results) if not isinstance(result, BaseException)]
+        if done:
+            await self._execute(_delete_messages, done)
+        if len(done) < len(messages):
+            logger.debug("Не удалось убрать кнопки у %s уведомлений из %s", len(messages) - len(done), len(messages))
+        return len(done)
+
+    async def run_sweeper(self, remove_keyboard):
+        """Фоновая очистка раз в sweep_interval секунд"""
+        while True:
+            await asyncio.sleep(self.config.sweep_interval)
+            try:
+                # Пачками, пока есть что убирать и пока снятие удаётся
+                while await self.sweep(remove_keyboard) >= self.config.sweep_batch:
+                    pass
+            except Exception as e:
+                logger.error("Ошибка очистки уведомлений о вызовах: %s", e)
+
+    async def count_calls(self, domofon_ids: Iterable[int], since: float) -> Dict[int, int]:
+        """Число вызовов по домофонам, начавшихся после since (unix time)"""
+        return await self._execute(_count_calls, list(domofon_ids), since + self.config.ttl)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats['rejected'] = self.rejected
+        return stats
+
+def _insert_session(conn, session: CallSession):
+    with conn:
+        conn.execute(
+            "INSERT INTO call_sessions (session_id, domofon_id, tenant_id, state, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (session.session_id, session.domofon_id, session.tenant_id, session.state, session.expires_at)
+        )
+
+def _insert_messages(conn, session_id: str, messages: List[Tuple[str, int]]):
+    with conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO call_messages (session_id, chat_id, message_id) VALUES (?, ?, ?)",
+            [(session_id, str(chat_id), message_id) for chat_id, message_id in messages]
+        )
+
+def _select_session(conn, session_id: str) -> Optional[CallSession]:
+    row = conn.execute(
+        "SELECT session_id, domofon_id, tenant_id, expires_at, state FROM call_sessions WHERE session_id = ?",
+        (session_id,)
+    ).fetchone()
+    return CallSession(*row) if row else None
+
+def _update_state(conn, session_id: str, state: str, chat_id: str, message_id: Optional[int], now: float) -> bool:
+    with conn:
+        changed = conn.execute(
+            "UPDATE call_sessions SET state = ?, resolved_by = ? "
+            "WHERE session_id = ? AND state = ? AND expires_at > ?",
+            (state, chat_id, session_id, RINGING, now)
+        ).rowcount
+        if changed and message_id is not None:
+            conn.execute(
+                "DELETE FROM call_messages WHERE session_id = ? AND chat_id = ? AND message_id = ?",
+                (session_id, chat_id, message_id)
+            )
+    return bool(changed)
+
+def _select_stale_messages(conn, now: float, limit: int, retention: float) -> List[Tuple[int, str, int]]:
+    """Сообщения завершённых и истёкших вызовов: (rowid, chat_id, message_id).
+
+    Заодно удаляются устаревшие сессии, у которых сообщений не осталось.
+    """
+    with conn:
+        rows = conn.execute(
+            "SELECT m.rowid, m.chat_id, m.message_id FROM call_messages m "
+            "JOIN call_sessions s ON s.session_id = m.session_id "
+            "WHERE s.expires_at <= ? OR s.state != ? LIMIT ?",
+            (now, RINGING, limit)
+        ).fetchall()
+        conn.execute(
+            "DELETE FROM call_sessions WHERE expires_at <= ? "
+            "AND NOT EXISTS (SELECT 1 FROM call_messages m WHERE m.session_id = call_sessions.session_id)",
+            (now - retention,)
+        )
+    return rows
+
+def _delete_messages(conn, rowids: List[int]):
+    with conn:
+        conn.executemany("DELETE FROM call_messages WHERE rowid = ?", [(rowid,) for rowid in rowids])
+
+def _count_calls(conn, domofon_ids: List[int], expires_after: float) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    # Лимит SQLite на число параметров запроса
+    for start in range(0, len(domofon_ids), 500):
+        chunk = domofon_ids[start:start + 500]
+        counts.update(conn.execute(
+            "SELECT domofon_id, COUNT(*) FROM call_sessions "
+            f"WHERE expires_at > ? AND domofon_id IN ({', '.join('?' * len(chunk))}) GROUP BY domofon_id",
+            (expires_after, *chunk)
+        ).fetchall())
+    return counts
@@ -0,0 +1,60 @@
+import logging
+import os
+import sqlite3
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = 'domophone.db'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS super_users (
+    phone_number TEXT PRIMARY KEY,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS tenants (
+    tenant_id INTEGER PRIMARY KEY,
+    phone TEXT NOT NULL,
+    chat_id TEXT,
+    name TEXT,
+    is_super_user INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_tenants_phone ON tenants (phone);
+CREATE INDEX IF NOT EXISTS idx_tenants_chat_id ON tenants (chat_id);
+CREATE INDEX IF NOT EXISTS idx_tenants_updated_at ON tenants (updated_at);
+CREATE TABLE IF NOT EXISTS call_sessions (
+    session_id TEXT PRIMARY KEY,
+    domofon_id INTEGER NOT NULL,
+    tenant_id INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ringing',
+    expires_at REAL NOT NULL,
+    resolved_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_call_sessions_expires_at ON call_sessions (expires_at);
+CREATE TABLE IF NOT EXISTS call_messages (
+    session_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (session_id, chat_id, message_id)
+);
+CREATE TABLE IF NOT EXISTS user_sessions (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Подключение к domophone.db в режиме WAL с созданием недостающих таблиц.
+
+    DB_PATH читается при подключении, а не при импорте: к этому моменту
+    точка входа уже загрузила .env.
+    """
+    conn = sqlite3.connect(path or os.getenv('DB_PATH', DEFAULT_DB_PATH), check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.executescript(_SCHEMA)
+    conn.commit()
+    return conn
@@ -6,6 +6,9 @@ if [ "$SERVICE_TYPE" = "bot" ]; then
 elif [ "$SERVICE_TYPE" = "webhook" ]; then
     echo "Starting webhook server..."
     python webhook_server.py
+elif [ "$SERVICE_TYPE" = "asgi" ]; then
+    echo "Starting ASGI server (Telegram webhook + intercom webhook)..."
+    exec hypercorn asgi:app --bind 0.0.0.0:${PORT:-5000} --workers ${WEB_CONCURRENCY:-1}
 else
     echo "Unknown service type: $SERVICE_TYPE"
     exit 1
@@ -0,0 +1,269 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest
+
+from cache import SingleFlight, TTLCache
+from media_cache import CachedSnapshot, SnapshotCache
+from telegram_scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class LiveViewConfig:
+    enabled: bool = True
+    # Период обновления снимка и длительность трансляции после запуска или «Обновить»
+    interval: float = 3.0
+    duration: float = 60.0
+    # Сколько трансляций может идти одновременно во всём боте
+    max_active: int = 50
+    # Минимальный промежуток между нажатиями «Камера»/«Обновить» в одном чате
+    chat_throttle: float = 2.0
+    # После стольких неудачных снимков подряд трансляция останавливается
+    max_failures: int = 3
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('LIVE_VIEW_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            interval=float(os.getenv('LIVE_VIEW_INTERVAL', cls.interval)),
+            duration=float(os.getenv('LIVE_VIEW_DURATION', cls.duration)),
+            max_active=int(os.getenv('LIVE_VIEW_MAX_ACTIVE', cls.max_active)),
+            chat_throttle=float(os.getenv('LIVE_VIEW_CHAT_THROTTLE', cls.chat_throttle)),
+            max_failures=int(os.getenv('LIVE_VIEW_MAX_FAILURES', cls.max_failures))
+        )
+
+def live_keyboard(domofon_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🔄 Обновить", callback_data=f"liverefresh_{domofon_id}"),
+        InlineKeyboardButton("⏹ Стоп", callback_data=f"livestop_{domofon_id}")
+    ]])
+
+def stopped_keyboard(domofon_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("▶️ Смотреть снова", callback_data=f"live_{domofon_id}")
+    ]])
+
+@dataclass
+class LiveView:
+    chat_id: int
+    domofon_id: int
+    tenant_id: int
+    until: float
+    message_id: Optional[int] = None
+    task: Optional[asyncio.Task] = None
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+    # Кадр на экране: тот же объект не отправляется повторно
+    shown: Optional[CachedSnapshot] = None
+    shown_at: str = ''
+    force: bool = False
+
+class LiveViewManager:
+    """Трансляция с камеры обновлением одного сообщения со снимком.
+
+    Сообщение со снимком правится через edit_message_media раз в interval
+    секунд, пока не пройдёт duration (каждое «Обновить» продлевает её).
+    В одном чате идёт не больше одной трансляции, во всём боте - не больше
+    max_active. Снимок одного домофона загружается один раз на всех
+    зрителей: кадр живёт interval секунд, параллельные загрузки
+    объединяются, а file_id повторно используется через SnapshotCache.
+    """
+
+    def __init__(self, snapshot_cache: SnapshotCache, config: Optional[LiveViewConfig] = None):
+        self.snapshot_cache = snapshot_cache
+        self.config = config or LiveViewConfig()
+        self._views: Dict[int, LiveView] = {}
+        # Кадр живёт чуть меньше периода, чтобы к следующему тику он уже обновился
+        self._frames = TTLCache(maxsize=max(1, self.config.max_active) * 2, ttl=self.config.interval * 0.8)
+        self._flight = SingleFlight()
+        self._throttle = TTLCache(maxsize=10000, ttl=self.config.chat_throttle)
+        self.edits = 0
+        self.skipped = 0
+
+    @property
+    def active(self) -> int:
+        return len(self._views)
+
+    def throttled(self, chat_id: int) -> bool:
+        """True, если в чате недавно уже нажимали; иначе нажатие запоминается"""
+        if chat_id in self._throttle:
+            return True
+        self._throttle.set(chat_id, True)
+        return False
+
+    def can_start(self, chat_id: int) -> bool:
+        if not self.config.enabled:
+            return False
+        # Новая трансляция в чате заменяет прежнюю и места не занимает
+        return chat_id in self._views or len(self._views) < self.config.max_active
+
+    def get(self, chat_id: int, message_id: int) -> Optional[LiveView]:
+        view = self._views.get(chat_id)
+        return view if view is not None and view.message_id == message_id else None
+
+    async def frame(self, domofon_id: int, tenant_id: int, force: bool = False) -> Optional[CachedSnapshot]:
+        """Текущий кадр домофона, общий для всех зрителей"""
+        if not force:
+            frame = self._frames.get(domofon_id)
+            if frame is not None:
+                return frame
+        return await self._flight.do(domofon_id, lambda: self._load_frame(domofon_id, tenant_id))
+
+    async def _load_frame(self, domofon_id: int, tenant_id: int) -> Optional[CachedSnapshot]:
+        frame = await self.snapshot_cache.load(domofon_id, tenant_id)
+        if frame is not None:
+            self._frames.set(domofon_id, frame)
+        return frame
+
+    async def start(self, bot, chat_id: int, domofon_id: int, tenant_id: int, message_id: Optional[int] = None) -> Optional[LiveView]:
+        """Запуск трансляции: первый кадр в сообщение message_id или новым сообщением.
+
+        None, если у камеры нет снимка. Ошибки API при первом кадре
+        передаются вызывающему коду.
+        """
+        frame = await self.frame(domofon_id, tenant_id)
+        if frame is None:
+            return None
+
+        previous = self._views.get(chat_id)
+        if previous is not None and previous.message_id != message_id:
+            await self.stop(bot, chat_id)
+        elif previous is not None:
+            self._cancel(previous)
+
+        view = LiveView(
+            chat_id=chat_id,
+            domofon_id=domofon_id,
+            tenant_id=tenant_id,
+            until=time.monotonic() + self.config.duration,
+            message_id=message_id
+        )
+        await self._show(bot, view, frame, priority=None)
+        self._views[chat_id] = view
+        view.task = asyncio.create_task(self._run(bot, view), name=f"live-view-{chat_id}")
+        return view
+
+    def refresh(self, view: LiveView):
+        """Внеочередной кадр и продление трансляции"""
+        view.until = time.monotonic() + self.config.duration
+        view.force = True
+        view.wakeup.set()
+
+    async def stop(self, bot, chat_id: int) -> bool:
+        """Остановка трансляции в чате: кнопки меняются на «Смотреть снова»"""
+        view = self._views.get(chat_id)
+        if view is None:
+            return False
+        self._cancel(view)
+        await self._finish(bot, view)
+        return True
+
+    def _cancel(self, view: LiveView):
+        if self._views.get(view.chat_id) is view:
+            del self._views[view.chat_id]
+        if view.task is not None and view.task is not asyncio.current_task():
+            view.task.cancel()
+
+    async def _run(self, bot, view: LiveView):
+        failures = 0
+        while True:
+            timeout = min(self.config.interval, view.until - time.monotonic())
+            if timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(view.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            view.wakeup.clear()
+            if time.monotonic() >= view.until:
+                break
+
+            force, view.force = view.force, False
+            try:
+                frame = await self.frame(view.domofon_id, view.tenant_id, force=force)
+                if frame is None or frame is view.shown:
+                    self.skipped += 1
+                else:
+                    await self._show(bot, view, frame, priority=Priority.INFO)
+                failures = 0
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    continue
+                # Сообщение удалено или слишком старое - править нечего
+                logger.debug("Трансляция в чате %s прервана: %s", view.chat_id, e)
+                self._cancel(view)
+                return
+            except Exception as e:
+                failures += 1
+                logger.warning("Не удалось обновить трансляцию домофона %s: %s", view.domofon_id, e)
+                if failures >= self.config.max_failures:
+                    break
+
+        self._cancel(view)
+        await self._finish(bot, view)
+
+    async def _show(self, bot, view: LiveView, frame: CachedSnapshot, priority: Optional[Priority]):
+        shown_at = datetime.now().strftime("%H:%M:%S")
+        caption = f"📷 Камера, трансляция\n🕐 Обновлено: {shown_at}"
+        reply_markup = live_keyboard(view.domofon_id)
+
+        async def send(photo):
+            if view.message_id is None:
+                return await bot.send_photo(
+                    chat_id=view.chat_id,
+                    photo=photo,
+                    caption=caption,
+                    reply_markup=reply_markup,
+                    rate_limit_args=priority
+                )
+            return await bot.edit_message_media(
+                chat_id=view.chat_id,
+                message_id=view.message_id,
+                media=InputMediaPhoto(media=photo, caption=caption),
+                reply_markup=reply_markup,
+                rate_limit_args=priority
+            )
+
+        message = await self.snapshot_cache.send(view.domofon_id, frame, send)
+        if view.message_id is None and message is not None:
+            view.message_id = message.message_id
+        view.shown = frame
+        view.shown_at = shown_at
+        self.edits += 1
+
+    async def _finish(self, bot, view: LiveView):
+        """Последний кадр остаётся в сообщении, кнопки - «Смотреть снова»"""
+        if view.message_id is None:
+            return
+        try:
+            await bot.edit_message_caption(
+                chat_id=view.chat_id,
+                message_id=view.message_id,
+                caption=f"📷 Снимок с камеры\n🕐 {view.shown_at}\n⏹ Трансляция остановлена",
+                reply_markup=stopped_keyboard(view.domofon_id),
+                rate_limit_args=Priority.INFO
+            )
+        except Exception as e:
+            logger.debug("Не удалось завершить трансляцию в чате %s: %s", view.chat_id, e)
+
+    async def close(self):
+        """Остановка всех трансляций без правки сообщений (при остановке бота)"""
+        views, self._views = list(self._views.values()), {}
+        for view in views:
+            if view.task is not None:
+                view.task.cancel()
+        await asyncio.gather(*(v.task for v in views if v.task is not None), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._frames.stats()
+        stats['active'] = self.active
+        stats['edits'] = self.edits
+        stats['skipped'] = self.skipped
+        stats['coalesced'] = self._flight.coalesced
+        return stats
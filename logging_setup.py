@@ -0,0 +1,94 @@
+"""Общая настройка логирования бота и сервера вебхуков.
+
+Записи попадают в очередь и выводятся отдельным потоком, поэтому вызов
+logger.info() в обработчиках не ждёт ввода-вывода. Сообщения форматируются
+только в этом потоке (передавайте аргументы через %s, а не f-строкой),
+там же из них вырезаются телефоны и токены.
+"""
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, List, Optional
+import atexit
+import logging
+import os
+import queue
+import random
+import re
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Российские номера: 7XXXXXXXXXX, +7..., 8..., в том числе с пробелами, скобками и дефисами
+_PHONE_RE = re.compile(r'(?<!\d)(?:\+?7|8)[\s(-]*\d{3}[\s)-]*\d{3}[\s-]*\d{2}[\s-]*\d{2}(?!\d)')
+# Токен Telegram-бота, в том числе внутри URL Bot API
+_BOT_TOKEN_RE = re.compile(r'\d{6,}:[A-Za-z0-9_-]{30,}')
+# Значения ключей и заголовков авторизации
+_SECRET_RE = re.compile(r'(?i)((?:x-api-key|api_token|token|authorization|secret)["\']?\s*[:=]\s*["\']?(?:bearer\s+)?)[^\s"\',}]+')
+
+_listener: Optional[QueueListener] = None
+
+def redact(text: str) -> str:
+    """Замена телефонов и токенов в строке"""
+    text = _BOT_TOKEN_RE.sub('<token>', text)
+    text = _SECRET_RE.sub(r'\1<secret>', text)
+    for secret in _configured_secrets():
+        text = text.replace(secret, '<secret>')
+    return _PHONE_RE.sub(_mask_phone, text)
+
+def _mask_phone(match: 're.Match') -> str:
+    digits = ''.join(ch for ch in match.group(0) if ch.isdigit())
+    return f'***{digits[-2:]}'
+
+def _configured_secrets() -> List[str]:
+    return [value for value in (os.getenv('TELEGRAM_TOKEN'), os.getenv('API_TOKEN')) if value and len(value) >= 8]
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+class _LazyQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class Truncated:
+    """Тело ответа для лога: обрезается только если запись действительно выводится"""
+    __slots__ = ('text', 'limit')
+
+    def __init__(self, text: Any, limit: Optional[int] = None):
+        self.text = text
+        self.limit = limit if limit is not None else int(os.getenv('LOG_BODY_LIMIT', 200))
+
+    def __str__(self) -> str:
+        text = self.text if isinstance(self.text, str) else repr(self.text)
+        if len(text) <= self.limit:
+            return text
+        return f'{text[:self.limit]}... ({len(text)} символов)'
+
+def log_body(logger: logging.Logger, message: str, body: Any, *args):
+    """Отладочный лог тела ответа: только часть записей (LOG_BODY_SAMPLE_RATE) и в обрезанном виде"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= float(os.getenv('LOG_BODY_SAMPLE_RATE', 0.01)):
+        return
+    logger.debug(message + ': %s', *args, Truncated(body))
+
+def setup_logging(level: Optional[str] = None):
+    """Вывод логов через очередь и фоновый поток (повторный вызов ничего не делает)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(RedactingFormatter(FORMAT))
+    log_queue: 'queue.SimpleQueue[logging.LogRecord]' = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_LazyQueueHandler(log_queue))
+    root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+    # httpx пишет каждый запрос (с URL) на INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
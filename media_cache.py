@@ -0,0 +1,308 @@
+from dataclasses import dataclass
+from typing import IO, Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+import asyncio
+import logging
+import os
+import tempfile
+
+from telegram import InputFile
+from telegram.error import BadRequest
+
+from api_client import ApiClient, ApiClientError
+from cache import TTLCache, SingleFlight
+from models import MediaUrls
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SnapshotCacheConfig:
+    enabled: bool = False
+    ttl: float = 5.0
+    max_entries: int = 1000
+    max_bytes: int = 64 * 1024 * 1024
+    max_snapshot_bytes: int = 5 * 1024 * 1024
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('SNAPSHOT_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes'),
+            ttl=float(os.getenv('SNAPSHOT_CACHE_TTL', cls.ttl)),
+            max_entries=int(os.getenv('SNAPSHOT_CACHE_MAX_ENTRIES', cls.max_entries)),
+            max_bytes=int(os.getenv('SNAPSHOT_CACHE_MAX_BYTES', cls.max_bytes)),
+            max_snapshot_bytes=int(os.getenv('SNAPSHOT_MAX_BYTES', cls.max_snapshot_bytes))
+        )
+
+@dataclass
+class CachedSnapshot:
+    url: str
+    content: Optional[bytes] = None
+    file_id: Optional[str] = None
+
+    @property
+    def photo(self) -> Union[str, bytes]:
+        """Что передавать в send_photo: file_id, байты или ссылку"""
+        return self.file_id or self.content or self.url
+
+class SnapshotCache:
+    """Кэш снимков с камер: байты JPEG и file_id, выданный Telegram.
+
+    Снимок скачивается один раз и загружается в Telegram один раз, после
+    чего в течение ttl всем получателям отправляется полученный file_id.
+    """
+
+    def __init__(self, api_client: ApiClient, config: Optional[SnapshotCacheConfig] = None):
+        self.api_client = api_client
+        self.config = config or SnapshotCacheConfig()
+        self._cache = TTLCache(
+            maxsize=self.config.max_entries,
+            ttl=self.config.ttl,
+            weigher=lambda entry: len(entry.content or b''),
+            max_weight=self.config.max_bytes
+        )
+        self._flight = SingleFlight()
+        self._uploads: Dict[int, asyncio.Future] = {}
+        self.uploads = 0
+        self.reused = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.config.enabled
+
+    async def prepare(self, domofon_id: int, tenant_id: int) -> Optional[CachedSnapshot]:
+        """Свежий снимок из кэша или загрузка нового. None, если у камеры нет снимка"""
+        if not self.enabled:
+            media = await self.api_client.get_snapshot_media(domofon_id, tenant_id)
+            url = media.jpeg if media else None
+            return CachedSnapshot(url=url) if url else None
+
+        entry = self._cache.get(domofon_id)
+        if entry is not None:
+            return entry
+        return await self._flight.do(domofon_id, lambda: self._load(domofon_id, tenant_id))
+
+    async def load(self, domofon_id: int, tenant_id: int) -> Optional[CachedSnapshot]:
+        """Новый снимок в обход кэша (кэш, если включён, обновляется)"""
+        if not self.enabled:
+            return await self.prepare(domofon_id, tenant_id)
+        return await self._flight.do(domofon_id, lambda: self._load(domofon_id, tenant_id))
+
+    async def _load(self, domofon_id: int, tenant_id: int) -> Optional[CachedSnapshot]:
+        media = await self.api_client.get_snapshot_media(domofon_id, tenant_id)
+        url = media.jpeg if media else None
+        if not url:
+            return None
+
+        entry = CachedSnapshot(url=url)
+        try:
+            entry.content = await self.api_client.download_media(url, self.config.max_snapshot_bytes)
+        except Exception as e:
+            # Без байтов Telegram скачает снимок по ссылке сам
+            logger.warning("Не удалось скачать снимок домофона %s: %s", domofon_id, e)
+        self._cache.set(domofon_id, entry)
+        return entry
+
+    async def send(self, domofon_id: int, entry: CachedSnapshot, send: Callable[[Any], Awaitable[Any]]) -> Any:
+        """Отправка снимка через send(photo) с повторным использованием file_id"""
+        if not self.enabled:
+            return await send(entry.photo)
+
+        if entry.file_id:
+            self.reused += 1
+            return await send(entry.file_id)
+
+        pending = self._uploads.get(domofon_id)
+        if pending is not None:
+            # Снимок уже загружается в Telegram - дожидаемся file_id
+            file_id = await asyncio.shield(pending)
+            if file_id:
+                self.reused += 1
+                return await send(file_id)
+            return await send(entry.photo)
+
+        future = asyncio.get_running_loop().create_future()
+        self._uploads[domofon_id] = future
+        try:
+            message = await send(entry.photo)
+            if message is not None and getattr(message, 'photo', None):
+                entry.file_id = message.photo[-1].file_id
+                # Байты больше не нужны - дальше отправляем по file_id
+                entry.content = None
+                self._cache.set(domofon_id, entry)
+                self.uploads += 1
+            future.set_result(entry.file_id)
+            return message
+        except BaseException:
+            future.set_result(None)
+            raise
+        finally:
+            self._uploads.pop(domofon_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self._cache.stats()
+        stats['uploads'] = self.uploads
+        stats['reused'] = self.reused
+        return stats
+
+# Ограничения Telegram на превью видео
+THUMBNAIL_MAX_BYTES = 200 * 1024
+THUMBNAIL_MAX_SIDE = 320
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Ширина и высота JPEG из заголовка кадра (SOF). None, если его нет"""
+    if data[:2] != b'\xff\xd8':
+        return None
+    pos = 2
+    while pos + 9 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        # SOF0-SOF15, кроме DHT, JPG и DAC
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+            return width, height
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+    return None
+
+class StreamedInputFile(InputFile):
+    """Файл для отправки в Telegram без чтения в память.
+
+    InputFile из python-telegram-bot читает файл целиком, а httpx, получив
+    файловый объект, отправляет его по частям с начала файла.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, file: IO[bytes], filename: str):
+        super().__init__(b'', filename=filename)
+        self.input_file_content = file
+
+@dataclass
+class ClipConfig:
+    enabled: bool = True
+    # Ограничения одного видео: размер файла и время его загрузки с сервера камер
+    max_bytes: int = 20 * 1024 * 1024
+    max_seconds: float = 15.0
+    # Сколько видео загружается одновременно и сколько ждёт очереди
+    max_concurrent: int = 2
+    max_pending: int = 8
+    upload_timeout: float = 120.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('VIDEO_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            max_bytes=int(os.getenv('VIDEO_MAX_BYTES', cls.max_bytes)),
+            max_seconds=float(os.getenv('VIDEO_MAX_SECONDS', cls.max_seconds)),
+            max_concurrent=int(os.getenv('VIDEO_MAX_CONCURRENT', cls.max_concurrent)),
+            max_pending=int(os.getenv('VIDEO_MAX_PENDING', cls.max_pending)),
+            upload_timeout=float(os.getenv('VIDEO_UPLOAD_TIMEOUT', cls.upload_timeout))
+        )
+
+class ClipSender:
+    """Видео с камер домофонов: MP4 с сервера камер пересылается в Telegram.
+
+    Видео по частям записывается во временный файл на диске (с
+    ограничением размера и времени загрузки; видео сверх ограничений не
+    отправляется), а оттуда по частям отправляется в Telegram через
+    StreamedInputFile - целиком в памяти оно не держится. Одновременно
+    обрабатывается не больше max_concurrent видео. Отправка идёт фоновой
+    задачей и не занимает обработчик обновлений. Превью - снимок с той же
+    камеры, если он не больше ограничений Telegram.
+    """
+
+    def __init__(self, api_client: ApiClient, config: Optional[ClipConfig] = None):
+        self.api_client = api_client
+        self.config = config or ClipConfig()
+        self._semaphore = asyncio.Semaphore(max(1, self.config.max_concurrent))
+        self._tasks: set = set()
+        self.active = 0
+        self.sent = 0
+        self.sent_bytes = 0
+        self.rejected = 0
+
+    @property
+    def accepting(self) -> bool:
+        """Можно ли поставить ещё одно видео в очередь"""
+        return self.config.enabled and len(self._tasks) < self.config.max_concurrent + self.config.max_pending
+
+    def submit(self, work: Awaitable[Any]):
+        """Фоновая отправка видео; перед вызовом нужно проверить accepting"""
+        task = asyncio.ensure_future(work)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def reject(self):
+        self.rejected += 1
+
+    async def send(self, domofon_id: int, tenant_id: int, send: Callable[[InputFile, Optional[bytes]], Awaitable[Any]]) -> Any:
+        """Видео с камеры через send(видео, превью). None, если у камеры нет видео"""
+        async with self._semaphore:
+            self.active += 1
+            try:
+                clip = await self.api_client.get_camera_clip(domofon_id, tenant_id)
+                if clip is None:
+                    return None
+                with tempfile.TemporaryFile() as file:
+                    thumbnail, size = await asyncio.gather(self._thumbnail(clip), self._download(clip.mp4, file))
+                    video = StreamedInputFile(file, filename=f"domofon_{domofon_id}.mp4")
+                    try:
+                        message = await send(video, thumbnail)
+                    except BadRequest as e:
+                        if thumbnail is None:
+                            raise
+                        # Превью необязательно - без него видео отправляется как есть
+                        logger.info("Telegram не принял превью видео домофона %s: %s", domofon_id, e)
+                        message = await send(video, None)
+                self.sent += 1
+                self.sent_bytes += size
+                return message
+            finally:
+                self.active -= 1
+
+    async def _download(self, url: str, file: IO[bytes]) -> int:
+        size = 0
+        async for chunk in self.api_client.stream_media(url, self.config.max_bytes, self.config.max_seconds):
+            file.write(chunk)
+            size += len(chunk)
+        # httpx берёт длину файла из fstat - буфер должен быть записан
+        file.flush()
+        if not size:
+            raise ApiClientError("Сервер камер вернул пустое видео")
+        return size
+
+    async def _thumbnail(self, clip: MediaUrls) -> Optional[bytes]:
+        """Снимок с камеры в качестве превью; без него видео отправляется как есть"""
+        if not clip.jpeg:
+            return None
+        try:
+            thumbnail = await self.api_client.download_media(clip.jpeg, THUMBNAIL_MAX_BYTES)
+        except ApiClientError as e:
+            logger.debug("Превью для видео домофона %s не получено: %s", clip.intercom_id, e)
+            return None
+        size = _jpeg_size(thumbnail)
+        if size is None or max(size) > THUMBNAIL_MAX_SIDE:
+            # Уменьшать снимок нечем, а больше 320 px Telegram не принимает
+            logger.debug("Снимок домофона %s не подходит для превью: %s", clip.intercom_id, size)
+            return None
+        return thumbnail
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'depth': len(self._tasks),
+            'active': self.active,
+            'sent': self.sent,
+            'sent_bytes': self.sent_bytes,
+            'rejected': self.rejected
+        }
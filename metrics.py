@@ -0,0 +1,300 @@
+"""Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Использование повторяет prometheus_client:
+
+    UPSTREAM_ERRORS.labels('check-tenant', 'timeout').inc()
+    with UPSTREAM_LATENCY.labels('open').time():
+        ...
+"""
+from bisect import bisect_left
+from contextlib import contextmanager, suppress
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import functools
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Registry:
+    def __init__(self):
+        self._metrics: List['_Metric'] = []
+
+    def register(self, metric: '_Metric'):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error("Ошибка сбора метрики %s: %s", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in self._children.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {child.value}')
+        return lines
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    @contextmanager
+    def track(self, *values):
+        """Счётчик выполняющихся операций внутри блока"""
+        child = self.labels(*values)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+class CallbackGauge(_Metric):
+    """Gauge, значения которого вычисляются при сборе метрик"""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str], fn: Callable[[], Dict[Tuple[str, ...], float]], registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self._fn = fn
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, value in self._fn().items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {child.count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {child.sum}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {child.count}')
+        return lines
+
+# Статистика кэшей: имя -> функция, возвращающая stats() кэша
+_caches: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+def register_cache(name: str, stats: Callable[[], Dict[str, Any]]):
+    """Публикация hits/misses/hit_ratio кэша (повторная регистрация заменяет прежнюю)"""
+    _caches[name] = stats
+
+def _cache_values(field: str) -> Dict[Tuple[str, ...], float]:
+    return {(name,): stats().get(field, 0) for name, stats in list(_caches.items())}
+
+# Очереди: имя -> функция, возвращающая stats() с полем depth
+_queues: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+def register_queue(name: str, stats: Callable[[], Dict[str, Any]]):
+    _queues[name] = stats
+
+UPSTREAM_LATENCY = Histogram(
+    'domophone_upstream_request_seconds', 'Время запроса к API домофонов', ['endpoint']
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'domophone_upstream_in_flight', 'Выполняющиеся запросы к API домофонов', ['endpoint']
+)
+UPSTREAM_ERRORS = Counter(
+    'domophone_upstream_errors_total', 'Ошибки запросов к API домофонов', ['endpoint', 'kind']
+)
+TELEGRAM_LATENCY = Histogram(
+    'domophone_telegram_request_seconds', 'Время запроса к Telegram Bot API', ['method']
+)
+TELEGRAM_IN_FLIGHT = Gauge(
+    'domophone_telegram_in_flight', 'Выполняющиеся запросы к Telegram Bot API', ['method']
+)
+TELEGRAM_ERRORS = Counter(
+    'domophone_telegram_errors_total', 'Ошибки запросов к Telegram Bot API', ['method', 'kind']
+)
+TELEGRAM_QUEUE_WAIT = Histogram(
+    'domophone_telegram_queue_wait_seconds', 'Ожидание в очереди исходящих сообщений', ['priority']
+)
+RING_TO_NOTIFICATION = Histogram(
+    'domophone_ring_to_notification_seconds', 'Время от вызова в домофон до отправки уведомления',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 20.0, 30.0)
+)
+CALLS = Counter(
+    'domophone_calls_total', 'Входящие вызовы по результату обработки', ['result']
+)
+CACHE_HITS = CallbackGauge(
+    'domophone_cache_hits', 'Попадания в кэш', ['cache'], lambda: _cache_values('hits')
+)
+CACHE_MISSES = CallbackGauge(
+    'domophone_cache_misses', 'Промахи кэша', ['cache'], lambda: _cache_values('misses')
+)
+CACHE_HIT_RATIO = CallbackGauge(
+    'domophone_cache_hit_ratio', 'Доля попаданий в кэш', ['cache'], lambda: _cache_values('hit_ratio')
+)
+CACHE_SIZE = CallbackGauge(
+    'domophone_cache_entries', 'Число записей в кэше', ['cache'], lambda: _cache_values('size')
+)
+STARTUP_PHASE = Gauge(
+    'domophone_startup_phase_seconds', 'Длительность фаз запуска процесса', ['phase']
+)
+READY = Gauge(
+    'domophone_ready', 'Процесс прогрет и принимает трафик'
+)
+QUEUE_DEPTH = CallbackGauge(
+    'domophone_queue_depth', 'Длина очереди', ['queue'],
+    lambda: {(name,): stats().get('depth', 0) for name, stats in list(_queues.items())}
+)
+
+_STATUS_TEXT = {200: 'OK', 404: 'Not Found', 503: 'Service Unavailable'}
+
+async def _handle_metrics_connection(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    routes: Dict[str, Callable[[], Tuple[int, Dict[str, Any]]]]
+):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        path = parts[1].split('?')[0] if len(parts) >= 2 else ''
+        if path == '/metrics':
+            code, body, content_type = 200, REGISTRY.render().encode(), CONTENT_TYPE
+        elif path in routes:
+            code, payload = routes[path]()
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode(), 'application/json'
+        else:
+            code, body, content_type = 404, b'Not Found\n', 'text/plain'
+        writer.write(
+            f'HTTP/1.1 {code} {_STATUS_TEXT.get(code, "")}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        # Обрыв соединения или медленный клиент - сервер метрик продолжает работу
+        logger.debug("Ошибка обработки запроса к серверу метрик: %r", e)
+    finally:
+        writer.close()
+        with suppress(ConnectionError):
+            await writer.wait_closed()
+
+async def start_metrics_server(
+    host: str = '0.0.0.0',
+    port: int = 9100,
+    routes: Optional[Dict[str, Callable[[], Tuple[int, Dict[str, Any]]]]] = None
+) -> asyncio.AbstractServer:
+    """HTTP-сервер с /metrics для процессов без своего веб-сервера (бот).
+
+    routes - дополнительные пути (/healthz, /readyz): функция возвращает
+    код ответа и тело, которое отдаётся в JSON.
+    """
+    server = await asyncio.start_server(
+        functools.partial(_handle_metrics_connection, routes=routes or {}), host, port
+    )
+    logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return server
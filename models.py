@@ -0,0 +1,148 @@
+"""Типизированные модели ответов API домофонов.
+
+Ответ разбирается и проверяется один раз - в ApiClient при получении,
+дальше код работает с неизменяемыми объектами со __slots__ вместо цепочек
+.get() по вложенным словарям. Поля, которых нет в ответе, получают
+значения по умолчанию; ошибкой (SchemaError) считается только ответ,
+который нельзя использовать: не тот тип или нет обязательного id.
+"""
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class SchemaError(ValueError):
+    """Ответ API не соответствует ожидаемой схеме"""
+    pass
+
+def loads(content: bytes) -> Any:
+    """Разбор JSON: через orjson, если он установлен"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+def _object(data: Any, what: str) -> dict:
+    if not isinstance(data, dict):
+        raise SchemaError(f"{what}: ожидался объект, получено {type(data).__name__}")
+    return data
+
+def _list(data: Any, what: str) -> list:
+    if data is None:
+        return []
+    if not isinstance(data, list):
+        raise SchemaError(f"{what}: ожидался список, получено {type(data).__name__}")
+    return data
+
+def _int(value: Any, what: str) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise SchemaError(f"{what}: ожидалось целое число, получено {value!r}")
+
+def _optional_int(value: Any, what: str) -> Optional[int]:
+    return None if value is None else _int(value, what)
+
+def _str(value: Any) -> str:
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+@dataclass(frozen=True, slots=True)
+class Resident:
+    """Жилец квартиры"""
+    phone: str
+    name: str
+    role: int = 0
+
+    @property
+    def is_owner(self) -> bool:
+        return self.role == 1
+
+    @classmethod
+    def from_api(cls, data: Any) -> 'Resident':
+        data = _object(data, 'tenant')
+        status = data.get('status')
+        role = status.get('role') if isinstance(status, dict) else None
+        return cls(
+            phone=_str(data.get('phone')),
+            name=_str(data.get('name')).strip(),
+            role=_optional_int(role, 'tenant.status.role') or 0
+        )
+
+@dataclass(frozen=True, slots=True)
+class Apartment:
+    """Квартира пользователя (элемент ответа /domo.apartment)"""
+    id: Optional[int]
+    address: str
+    number: str = ''
+    paid_before: str = ''
+    tenants: Tuple[Resident, ...] = ()
+
+    @classmethod
+    def from_api(cls, data: Any) -> 'Apartment':
+        data = _object(data, 'apartment')
+        location = data.get('location') or {}
+        if not isinstance(location, dict):
+            location = {}
+        return cls(
+            id=_optional_int(data.get('id'), 'apartment'),
+            address=_str(location.get('readable_address')) or 'Адрес не указан',
+            number=_str(location.get('apartments_number')),
+            paid_before=_str(data.get('paid_before')),
+            tenants=tuple(Resident.from_api(t) for t in _list(data.get('tenants'), 'apartment.tenants'))
+        )
+
+@dataclass(frozen=True, slots=True)
+class Intercom:
+    """Домофон квартиры (элемент ответа /domo.apartment/{id}/domofon)"""
+    id: int
+    name: str = ''
+
+    @property
+    def is_concierge(self) -> bool:
+        return 'консьерж' in self.name.lower()
+
+    @classmethod
+    def from_api(cls, data: Any) -> 'Intercom':
+        data = _object(data, 'domofon')
+        return cls(id=_int(data.get('id'), 'domofon'), name=_str(data.get('name')))
+
+@dataclass(frozen=True, slots=True)
+class MediaUrls:
+    """Ссылки на медиа камеры домофона (элемент ответа urlsOnType)"""
+    intercom_id: Optional[int]
+    jpeg: Optional[str] = None
+    mp4: Optional[str] = None
+
+    @classmethod
+    def from_api(cls, data: Any) -> 'MediaUrls':
+        data = _object(data, 'media')
+        return cls(
+            intercom_id=_optional_int(data.get('id', data.get('intercom_id')), 'media'),
+            jpeg=data.get('jpeg') or None,
+            mp4=data.get('mp4') or None
+        )
+
+@dataclass(frozen=True, slots=True)
+class TenantProfile:
+    """Пользователь, найденный по телефону (ответ /check-tenant)"""
+    tenant_id: Optional[int]
+    name: str = 'Неизвестный'
+    is_super_user: bool = False
+
+    @classmethod
+    def from_api(cls, data: Any) -> 'TenantProfile':
+        data = _object(data, 'tenant')
+        return cls(
+            tenant_id=_optional_int(data.get('tenant_id'), 'tenant'),
+            name=_str(data.get('name')) or 'Неизвестный',
+            is_super_user=bool(data.get('is_super_user', False))
+        )
+
+def parse_list(model, data: Any) -> Tuple[Any, ...]:
+    """Список объектов API в кортеж моделей model"""
+    return tuple(model.from_api(item) for item in _list(data, model.__name__))
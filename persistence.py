@@ -0,0 +1,173 @@
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class SQLitePersistence(BasePersistence):
+    """Хранение context.user_data бота в domophone.db.
+
+    Данные пользователя читаются из базы перед каждым его обновлением, а не
+    при запуске: при нескольких воркерах авторизация, полученная другим
+    процессом, видна сразу. Ключи, изменённые этим процессом и ещё не
+    записанные, из базы не перечитываются. Изменения копятся в памяти
+    (повторные изменения одного пользователя схлопываются) и записываются
+    одной транзакцией фоновой задачей раз в flush_interval секунд; при
+    ошибке записи пакет возвращается в очередь.
+    """
+
+    def __init__(self, path: Optional[str] = None, flush_interval: float = 1.0, update_interval: float = 5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._db_lock = asyncio.Lock()
+        self._pending: Dict[int, Optional[str]] = {}
+        # Данные пользователей в том виде, в каком они есть в базе
+        self._synced: Dict[int, Dict[Any, Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self.writes = 0
+
+    async def _execute(self, fn, *args):
+        """Работа с SQLite в отдельном потоке, чтобы не блокировать event loop"""
+        async with self._db_lock:
+            if self._conn is None:
+                self._conn = await asyncio.to_thread(db.connect, self.path)
+            return await asyncio.to_thread(fn, *args)
+
+    def _ensure_writer(self):
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_loop(), name="session-writer")
+
+    async def _write_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Окно накопления изменений перед записью
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self._write_pending()
+            except Exception as e:
+                logger.error("Ошибка записи сессий в базу, повтор через %s с: %s", self.flush_interval, e)
+                self._wakeup.set()
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self._execute(self._write_batch, batch)
+        except BaseException:
+            # Изменения, сделанные после снятия пакета, новее - их не трогаем
+            for user_id, data in batch.items():
+                self._pending.setdefault(user_id, data)
+            raise
+        for user_id, data in batch.items():
+            if data is None:
+                self._synced.pop(user_id, None)
+            else:
+                self._synced[user_id] = json.loads(data)
+        self.writes += len(batch)
+
+    def _write_batch(self, batch: Dict[int, Optional[str]]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO user_sessions (user_id, data, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                [(user_id, data) for user_id, data in batch.items() if data is not None]
+            )
+            self._conn.executemany(
+                "DELETE FROM user_sessions WHERE user_id = ?",
+                [(user_id,) for user_id, data in batch.items() if data is None]
+            )
+
+    def _load_user(self, user_id: int) -> Optional[str]:
+        row = self._conn.execute("SELECT data FROM user_sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Сессии загружаются лениво в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]):
+        stored = await self._execute(self._load_user, user_id)
+        if not stored:
+            return
+        # Запись мог сделать другой воркер. Ключ, который этот процесс изменил
+        # и ещё не записал (PTB передаёт изменения раз в update_interval, а
+        # пакет пишется в фоне), новее, чем в базе, и остаётся как есть
+        synced = self._synced.get(user_id, {})
+        for key, value in json.loads(stored).items():
+            if user_data.get(key, _MISSING) == synced.get(key, _MISSING):
+                user_data[key] = value
+        self._synced[user_id] = json.loads(stored)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]):
+        if not data:
+            # Пустые данные не затирают сохранённые (например, записанные
+            # другим воркером); удаление идёт через drop_user_data
+            return
+        self._pending[user_id] = json.dumps(data, ensure_ascii=False)
+        self._ensure_writer()
+        self._wakeup.set()
+
+    async def drop_user_data(self, user_id: int):
+        self._pending[user_id] = None
+        self._ensure_writer()
+        self._wakeup.set()
+
+    async def flush(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        await self._write_pending()
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    # Остальные данные бота не сохраняются
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id: int, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,119 @@
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Автомат closed/open/half-open для одного эндпоинта.
+
+    После failure_threshold ошибок подряд запросы отклоняются сразу в
+    течение recovery_timeout секунд, затем пропускаются
+    half_open_max_calls пробных запросов: успех закрывает автомат,
+    ошибка снова открывает его.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._half_open_calls = 0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self._half_open_calls = 0
+            logger.info("Автомат %s: пробные запросы после паузы", self.name)
+
+        if self.state == HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                self.rejected += 1
+                return False
+            self._half_open_calls += 1
+        return True
+
+    def release_probe(self):
+        """Пробный запрос завершился без ответа API (например, отменён): слот освобождается"""
+        if self.state == HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info("Автомат %s: API снова доступен", self.name)
+        self.state = CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning("Автомат %s: открыт после %s ошибок подряд", self.name, self.failures)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Экспоненциальная задержка с ограничением и полным джиттером"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class LatencyTracker:
+    """Скользящее окно задержек для расчёта перцентилей"""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def hedged(fn: Callable[[], Awaitable[Any]], delay: float, stats: Optional[Dict[str, int]] = None) -> Any:
+    """Вызов fn с дублирующим запросом, если первый не ответил за delay секунд.
+
+    Возвращается первый успешный результат, второй запрос отменяется.
+    """
+    first = asyncio.ensure_future(fn())
+    pending = {first}
+    error = None
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+
+        if stats is not None:
+            stats['hedged'] = stats.get('hedged', 0) + 1
+        second = asyncio.ensure_future(fn())
+        pending = {first, second}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second and stats is not None:
+                        stats['hedge_wins'] = stats.get('hedge_wins', 0) + 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,147 @@
+"""Фаза запуска: прогрев соединений и кэшей, готовность и время запуска.
+
+Модуль импортируется первым в точках входа (bot.py, webhook_server.py),
+поэтому REPORT отсчитывает время с начала импорта сервиса. Процесс
+объявляется готовым (/readyz отвечает 200) после прогрева: открыты
+соединения с API, для известных реестру пользователей загружены
+профили, квартиры и домофоны. Прогрев ограничен WARMUP_TIMEOUT - после
+него процесс готов с тем, что успел загрузить.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class WarmupConfig:
+    enabled: bool = True
+    # Сколько соединений с API открыть заранее
+    connections: int = 4
+    # Сколько известных реестру пользователей прогревать
+    tenants: int = 200
+    concurrency: int = 8
+    timeout: float = 30.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv('WARMUP_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+            connections=int(os.getenv('WARMUP_CONNECTIONS', cls.connections)),
+            tenants=int(os.getenv('WARMUP_TENANTS', cls.tenants)),
+            concurrency=int(os.getenv('WARMUP_CONCURRENCY', cls.concurrency)),
+            timeout=float(os.getenv('WARMUP_TIMEOUT', cls.timeout))
+        )
+
+class StartupReport:
+    """Длительность фаз запуска и признак готовности процесса"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self._last = self.started
+        self.phases: Dict[str, float] = {}
+        self.ready = False
+        self.ready_after: Optional[float] = None
+        self.warmed_tenants = 0
+        metrics.READY.set(0)
+
+    def mark(self, name: str):
+        """Фаза, закончившаяся сейчас и начавшаяся с предыдущей отметки"""
+        now = time.monotonic()
+        self._add(name, now - self._last)
+        self._last = now
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._last = time.monotonic()
+            self._add(name, self._last - started)
+
+    def _add(self, name: str, seconds: float):
+        # Фаза может повторяться (например, импорт двух модулей в asgi.py)
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        metrics.STARTUP_PHASE.labels(name).set(self.phases[name])
+
+    def set_ready(self, ready: bool = True):
+        self.ready = ready
+        metrics.READY.set(1 if ready else 0)
+        if ready and self.ready_after is None:
+            self.ready_after = time.monotonic() - self.started
+            logger.info(
+                "Сервис готов через %.2f с: %s",
+                self.ready_after,
+                ', '.join(f'{name}={seconds:.3f}' for name, seconds in self.phases.items())
+            )
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'status': 'ready' if self.ready else 'starting',
+            'ready_after_s': self.ready_after,
+            'uptime_s': time.monotonic() - self.started,
+            'warmed_tenants': self.warmed_tenants,
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()}
+        }
+
+REPORT = StartupReport()
+
+def healthz() -> Tuple[int, Dict[str, Any]]:
+    """Процесс жив и event loop отвечает"""
+    return 200, {'status': 'ok', 'uptime_s': time.monotonic() - REPORT.started}
+
+def readyz() -> Tuple[int, Dict[str, Any]]:
+    """Процесс прогрет и принимает трафик"""
+    return (200 if REPORT.ready else 503), REPORT.summary()
+
+HEALTH_ROUTES = {'/healthz': healthz, '/readyz': readyz}
+
+async def _warm_tenants(tenant_ids: Iterable[int], warm: Callable[[int], Awaitable[Any]], concurrency: int):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(tenant_id: int):
+        async with semaphore:
+            try:
+                await warm(tenant_id)
+                REPORT.warmed_tenants += 1
+            except Exception as e:
+                logger.debug("Прогрев пользователя %s не удался: %s", tenant_id, e)
+
+    await asyncio.gather(*(one(tenant_id) for tenant_id in tenant_ids))
+
+async def warm_up(api_client, registry, warm_tenant: Callable[[int], Awaitable[Any]], config: Optional[WarmupConfig] = None):
+    """Прогрев пула соединений с API и кэшей известных пользователей, затем готовность.
+
+    warm_tenant(tenant_id) загружает в кэши то, что понадобится при первом
+    запросе пользователя. Ошибки прогрева не мешают запуску.
+    """
+    config = config or WarmupConfig.from_env()
+    if not config.enabled:
+        REPORT.set_ready()
+        return
+
+    deadline = time.monotonic() + config.timeout
+    try:
+        with REPORT.phase('api_pool'):
+            opened = await asyncio.wait_for(api_client.warm_up(config.connections), config.timeout)
+        logger.info("Открыто соединений с API: %s из %s", opened, config.connections)
+
+        # Сначала пользователи, которым приходят уведомления
+        records = sorted(registry.records(), key=lambda r: r.chat_id is None)[:config.tenants]
+        with REPORT.phase('preload'):
+            await asyncio.wait_for(
+                _warm_tenants([r.tenant_id for r in records], warm_tenant, config.concurrency),
+                max(0.0, deadline - time.monotonic())
+            )
+    except asyncio.TimeoutError:
+        logger.warning("Прогрев не уложился в %s с, сервис запускается без него", config.timeout)
+    except Exception as e:
+        logger.warning("Ошибка прогрева: %s", e)
+    REPORT.set_ready()
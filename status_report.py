@@ -0,0 +1,175 @@
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Dict, Iterable, List, Optional
+import asyncio
+import logging
+import os
+import time
+
+from api_client import ApiClient, ApiClientError, MediaType, match_media
+from call_sessions import CallSessionStore
+from models import Apartment, Intercom
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StatusConfig:
+    # Через сколько секунд сводка отдаётся с тем, что успело ответить
+    deadline: float = 10.0
+    # Одновременных запросов к API и серверу камер
+    concurrency: int = 10
+    # Домофонов в одном запросе urlsOnType
+    batch_size: int = 50
+    snapshot_max_bytes: int = 5 * 1024 * 1024
+    # За сколько секунд считаются вызовы
+    calls_window: float = 86400.0
+    page_size: int = 15
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            deadline=float(os.getenv('STATUS_DEADLINE', cls.deadline)),
+            concurrency=int(os.getenv('STATUS_CONCURRENCY', cls.concurrency)),
+            batch_size=int(os.getenv('STATUS_BATCH_SIZE', cls.batch_size)),
+            snapshot_max_bytes=int(os.getenv('SNAPSHOT_MAX_BYTES', cls.snapshot_max_bytes)),
+            calls_window=float(os.getenv('STATUS_CALLS_WINDOW', cls.calls_window)),
+            page_size=int(os.getenv('STATUS_PAGE_SIZE', cls.page_size))
+        )
+
+@dataclass
+class IntercomStatus:
+    intercom: Intercom
+    address: str
+    # None - домофон не успел ответить до дедлайна
+    reachable: Optional[bool] = None
+    latency: Optional[float] = None
+    error: Optional[str] = None
+    calls: int = 0
+
+@dataclass
+class StatusReport:
+    intercoms: List[IntercomStatus] = field(default_factory=list)
+    # Квартиры, домофоны которых не удалось получить
+    missing_apartments: int = 0
+    elapsed: float = 0.0
+    complete: bool = True
+    calls_window: float = 0.0
+
+    @property
+    def reachable(self) -> int:
+        return sum(1 for s in self.intercoms if s.reachable)
+
+    @property
+    def unreachable(self) -> int:
+        return sum(1 for s in self.intercoms if s.reachable is False)
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for s in self.intercoms if s.reachable is None)
+
+async def _until(deadline: float, tasks: Iterable[Awaitable[Any]]) -> bool:
+    """Выполнение задач до дедлайна; незавершённые отменяются. True, если успели все"""
+    tasks = [asyncio.ensure_future(task) for task in tasks]
+    if not tasks:
+        return True
+    _, pending = await asyncio.wait(tasks, timeout=max(0.0, deadline - time.monotonic()))
+    for task in pending:
+        task.cancel()
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            logger.debug("Запрос для сводки не удался: %s", result)
+    return not pending
+
+def _error_text(e: ApiClientError) -> str:
+    # Текст ошибки соединения может быть очень длинным
+    return str(e)[:100]
+
+async def collect_status(
+    api_client: ApiClient,
+    call_sessions: CallSessionStore,
+    tenant_id: int,
+    config: Optional[StatusConfig] = None
+) -> StatusReport:
+    """Сводка по всем домофонам квартир пользователя.
+
+    Домофоны квартир запрашиваются параллельно, ссылки на снимки - пакетами
+    по batch_size через urlsOnType, затем каждый снимок скачивается с
+    замером времени. Одновременно выполняется не больше concurrency
+    запросов. Половина дедлайна отводится на список домофонов, остальное -
+    на снимки; по дедлайну сводка возвращается с тем, что успело ответить.
+    """
+    config = config or StatusConfig()
+    started = time.monotonic()
+    deadline = started + config.deadline
+    limit = asyncio.Semaphore(max(1, config.concurrency))
+    report = StatusReport(calls_window=config.calls_window)
+
+    apartments = await asyncio.wait_for(api_client.get_apartments(tenant_id), config.deadline)
+    statuses: Dict[int, IntercomStatus] = {}
+    answered = set()
+
+    async def load_apartment(apartment: Apartment):
+        async with limit:
+            domofons = await api_client.get_apartment_domofons(apartment.id, tenant_id)
+        answered.add(apartment.id)
+        for intercom in domofons:
+            statuses.setdefault(intercom.id, IntercomStatus(intercom, apartment.address))
+
+    with_id = [apartment for apartment in apartments if apartment.id]
+    report.complete = await _until(
+        started + config.deadline / 2, (load_apartment(apartment) for apartment in with_id)
+    )
+    report.missing_apartments = sum(1 for apartment in with_id if apartment.id not in answered)
+    report.intercoms = list(statuses.values())
+
+    async def check_snapshot(status: IntercomStatus, url: Optional[str]):
+        if not url:
+            status.reachable, status.error = False, "нет снимка"
+            return
+        async with limit:
+            check_started = time.monotonic()
+            try:
+                await api_client.download_media(url, config.snapshot_max_bytes)
+            except ApiClientError as e:
+                status.reachable, status.error = False, _error_text(e)
+                return
+            status.reachable, status.latency = True, time.monotonic() - check_started
+
+    async def check_batch(batch: List[IntercomStatus]):
+        ids = [s.intercom.id for s in batch]
+        try:
+            async with limit:
+                media = await api_client.get_media_urls(ids, tenant_id, [MediaType.JPEG])
+        except ApiClientError as e:
+            for status in batch:
+                status.reachable, status.error = False, _error_text(e)
+            return
+        if len(batch) > 1 and media and all(m.intercom_id is None for m in media):
+            # Ответ без id домофонов - как и в SnapshotBatcher, запрашиваем по одному
+            await asyncio.gather(*(check_batch([status]) for status in batch))
+            return
+        matched = match_media(ids, media)
+        await asyncio.gather(*(
+            check_snapshot(status, matched[status.intercom.id].jpeg if status.intercom.id in matched else None)
+            for status in batch
+        ))
+
+    async def count_calls():
+        counts = await call_sessions.count_calls(statuses, time.time() - config.calls_window)
+        for intercom_id, calls in counts.items():
+            statuses[intercom_id].calls = calls
+
+    # Если API уже ответил без id, пакеты бесполезны
+    batch_size = config.batch_size if api_client.snapshot_batcher.batching else 1
+    batches = [
+        report.intercoms[start:start + batch_size]
+        for start in range(0, len(report.intercoms), batch_size)
+    ]
+    checked = await _until(deadline, [*(check_batch(batch) for batch in batches), count_calls()])
+    report.complete = report.complete and checked
+    report.elapsed = time.monotonic() - started
+    if not report.complete:
+        logger.info(
+            "Сводка для %s собрана не полностью за %.1f с: без ответа %s домофонов, %s квартир",
+            tenant_id, report.elapsed, report.pending, report.missing_apartments
+        )
+    return report
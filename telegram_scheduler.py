@@ -0,0 +1,255 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from cache import TTLCache
+from metrics import TELEGRAM_ERRORS, TELEGRAM_IN_FLIGHT, TELEGRAM_LATENCY, TELEGRAM_QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    """Очереди исходящих сообщений: меньшее значение отправляется раньше"""
+    CALL = 0
+    ACTION = 1
+    INFO = 2
+
+_current_priority: ContextVar[Priority] = ContextVar('outbound_priority', default=Priority.INFO)
+
+# Лимиты Telegram распространяются только на отправку и изменение сообщений
+_LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+
+@contextmanager
+def outbound_priority(priority: Priority):
+    """Приоритет для всех запросов к Telegram внутри блока"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Время ожидания до появления свободного токена"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+@dataclass
+class RateLimiterConfig:
+    global_rate: float = 30.0
+    global_burst: float = 30.0
+    chat_rate: float = 1.0
+    chat_burst: float = 3.0
+    max_retries: int = 3
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            global_rate=float(os.getenv('TG_GLOBAL_RATE', cls.global_rate)),
+            global_burst=float(os.getenv('TG_GLOBAL_BURST', cls.global_burst)),
+            chat_rate=float(os.getenv('TG_CHAT_RATE', cls.chat_rate)),
+            chat_burst=float(os.getenv('TG_CHAT_BURST', cls.chat_burst)),
+            max_retries=int(os.getenv('TG_MAX_RETRIES', cls.max_retries))
+        )
+
+class TelegramRateLimiter(BaseRateLimiter):
+    """Планировщик исходящих запросов к Telegram Bot API.
+
+    Общий token bucket (~30 сообщений/с) и token bucket на каждый чат
+    (~1 сообщение/с), очереди по приоритетам (Priority) и повтор запроса
+    после RetryAfter. Приоритет берётся из rate_limit_args или задаётся
+    через outbound_priority().
+    """
+
+    def __init__(self, config: Optional[RateLimiterConfig] = None):
+        self.config = config or RateLimiterConfig()
+        self._global = TokenBucket(self.config.global_rate, self.config.global_burst)
+        # Простаивающий bucket заполняется за capacity/rate секунд, дольше хранить его незачем
+        self._chats = TTLCache(
+            maxsize=100000,
+            ttl=max(60.0, self.config.chat_burst / self.config.chat_rate)
+        )
+        self._ready: List[tuple] = []
+        self._delayed: List[tuple] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self.retries = 0
+        self._wait_stats: Dict[Priority, Dict[str, float]] = {
+            p: {'count': 0, 'total': 0.0, 'max': 0.0} for p in Priority
+        }
+
+    async def initialize(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch(), name="telegram-rate-limiter")
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        # Ожидающие запросы отпускаем без ограничения, чтобы не потерять их при остановке
+        for item in self._ready + [entry[2] for entry in self._delayed]:
+            if not item[3].done():
+                item[3].set_result(None)
+        self._ready.clear()
+        self._delayed.clear()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Priority]
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            return await self._call(callback, args, kwargs, endpoint)
+
+        priority = rate_limit_args if isinstance(rate_limit_args, Priority) else _current_priority.get()
+        chat_id = data.get('chat_id')
+        if chat_id is not None:
+            # Один чат может прийти числом или строкой (в том числе @username)
+            chat_id = str(chat_id)
+
+        for attempt in range(self.config.max_retries + 1):
+            await self._acquire(chat_id, priority)
+            try:
+                return await self._call(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                if attempt == self.config.max_retries:
+                    raise
+                delay = _retry_after_seconds(e)
+                self.retries += 1
+                logger.warning("Telegram ограничил отправку (%s, chat_id=%s), повтор через %s с", endpoint, chat_id, delay)
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self._global
+                bucket.pause(delay)
+
+    async def _call(self, callback, args: Any, kwargs: Dict[str, Any], endpoint: str):
+        """Запрос к Bot API с учётом времени и ошибок по методам"""
+        started = time.monotonic()
+        try:
+            with TELEGRAM_IN_FLIGHT.track(endpoint):
+                return await callback(*args, **kwargs)
+        except Exception as e:
+            TELEGRAM_ERRORS.labels(endpoint, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_LATENCY.labels(endpoint).observe(time.monotonic() - started)
+
+    async def _acquire(self, chat_id: Any, priority: Priority):
+        """Ожидание своей очереди на отправку"""
+        if self._dispatcher is None or self._dispatcher.done():
+            await self.initialize()
+
+        enqueued_at = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._ready, (priority, next(self._seq), chat_id, future))
+        self._wakeup.set()
+        await future
+
+        waited = time.monotonic() - enqueued_at
+        stats = self._wait_stats[priority]
+        stats['count'] += 1
+        stats['total'] += waited
+        stats['max'] = max(stats['max'], waited)
+        TELEGRAM_QUEUE_WAIT.labels(priority.name.lower()).observe(waited)
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id, count=False)
+        if bucket is None:
+            bucket = TokenBucket(self.config.chat_rate, self.config.chat_burst)
+        # Повторная запись продлевает жизнь bucket в кэше
+        self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._delayed)[2])
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            item = heapq.heappop(self._ready)
+            priority, seq, chat_id, future = item
+            if future.done():
+                continue
+
+            chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            chat_delay = chat_bucket.delay(now) if chat_bucket else 0.0
+            if chat_delay > 0:
+                # Чат исчерпал лимит - не задерживаем из-за него остальные чаты
+                heapq.heappush(self._delayed, (now + chat_delay, seq, item))
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                heapq.heappush(self._ready, item)
+                await asyncio.sleep(global_delay)
+                continue
+
+            self._global.consume(now)
+            if chat_bucket:
+                chat_bucket.consume(now)
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Длина очередей и время ожидания отправки по приоритетам"""
+        return {
+            'queued': len(self._ready),
+            'delayed': len(self._delayed),
+            'retries': self.retries,
+            'wait': {
+                p.name.lower(): {
+                    'count': s['count'],
+                    'avg': s['total'] / s['count'] if s['count'] else 0.0,
+                    'max': s['max']
+                }
+                for p, s in self._wait_stats.items()
+            }
+        }
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
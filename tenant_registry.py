@@ -0,0 +1,197 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+import argparse
+import asyncio
+import csv
+import logging
+import sys
+
+import db
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class TenantRecord:
+    tenant_id: int
+    phone: str
+    chat_id: Optional[str] = None
+    name: Optional[str] = None
+    is_super_user: bool = False
+
+def normalize_phone(phone) -> str:
+    """Приведение телефона к формату 7XXXXXXXXXX"""
+    digits = ''.join(ch for ch in str(phone) if ch.isdigit())
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+class TenantRegistry:
+    """Реестр пользователей (tenant_id, телефон, chat id) в domophone.db.
+
+    Все записи держатся в памяти с индексами по tenant_id, телефону и
+    chat id, поэтому поиск не обращается к диску. Изменения, сделанные
+    другими процессами (например, ботом), подтягиваются раз в
+    reload_interval секунд.
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 30.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._conn = None
+        self._db_lock = asyncio.Lock()
+        self._by_tenant: Dict[int, TenantRecord] = {}
+        self._by_phone: Dict[str, TenantRecord] = {}
+        self._by_chat: Dict[str, TenantRecord] = {}
+        # Телефоны из таблицы super_users
+        self._super_phones: Set[str] = set()
+        self._last_updated = ''
+        self._reloader: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._by_tenant)
+
+    def get(self, tenant_id: int) -> Optional[TenantRecord]:
+        return self._by_tenant.get(tenant_id)
+
+    def get_by_phone(self, phone) -> Optional[TenantRecord]:
+        return self._by_phone.get(normalize_phone(phone))
+
+    def get_by_chat_id(self, chat_id) -> Optional[TenantRecord]:
+        return self._by_chat.get(str(chat_id))
+
+    def records(self) -> List[TenantRecord]:
+        return list(self._by_tenant.values())
+
+    def is_super_user(self, tenant_id: int) -> bool:
+        """Суперпользователь по профилю из API или по таблице super_users"""
+        record = self._by_tenant.get(tenant_id)
+        return record is not None and (record.is_super_user or record.phone in self._super_phones)
+
+    def _index(self, record: TenantRecord):
+        previous = self._by_tenant.get(record.tenant_id)
+        if previous is not None:
+            # Как и в базе, пустые chat id и имя не затирают известные значения
+            record.chat_id = record.chat_id or previous.chat_id
+            record.name = record.name or previous.name
+            if self._by_phone.get(previous.phone) is previous:
+                del self._by_phone[previous.phone]
+            if previous.chat_id and self._by_chat.get(previous.chat_id) is previous:
+                del self._by_chat[previous.chat_id]
+        self._by_tenant[record.tenant_id] = record
+        self._by_phone[record.phone] = record
+        if record.chat_id:
+            self._by_chat[record.chat_id] = record
+
+    async def _execute(self, fn, *args):
+        async with self._db_lock:
+            if self._conn is None:
+                self._conn = await asyncio.to_thread(db.connect, self.path)
+            return await asyncio.to_thread(fn, self._conn, *args)
+
+    async def start(self):
+        """Загрузка реестра в память и запуск периодической подгрузки изменений"""
+        await self.reload()
+        logger.info("Реестр пользователей загружен: %s записей", len(self))
+        if self.reload_interval > 0 and self._reloader is None:
+            self._reloader = asyncio.create_task(self._reload_loop(), name="tenant-registry-reload")
+
+    async def close(self):
+        if self._reloader is not None:
+            self._reloader.cancel()
+            await asyncio.gather(self._reloader, return_exceptions=True)
+            self._reloader = None
+        if self._conn is not None:
+            await asyncio.to_thread(self._conn.close)
+            self._conn = None
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error("Ошибка обновления реестра пользователей: %s", e)
+
+    async def reload(self):
+        """Подгрузка записей, изменённых с момента прошлой загрузки"""
+        rows = await self._execute(_select_changed, self._last_updated)
+        for tenant_id, phone, chat_id, name, is_super_user, updated_at in rows:
+            self._index(TenantRecord(tenant_id, phone, chat_id, name, bool(is_super_user)))
+            self._last_updated = max(self._last_updated, updated_at or '')
+        # Таблица маленькая - читается целиком
+        self._super_phones = {normalize_phone(phone) for phone in await self._execute(_select_super_phones)}
+
+    async def upsert(self, record: TenantRecord):
+        """Сохранение пользователя (например, после авторизации в боте)"""
+        record.phone = normalize_phone(record.phone)
+        await self._execute(_upsert_many, [record])
+        self._index(record)
+
+    async def bulk_import(self, records: Iterable[TenantRecord]) -> int:
+        """Загрузка большого числа пользователей одной транзакцией"""
+        records = list(records)
+        for record in records:
+            record.phone = normalize_phone(record.phone)
+        await self._execute(_upsert_many, records)
+        for record in records:
+            self._index(record)
+        return len(records)
+
+def _select_changed(conn, since: str):
+    return conn.execute(
+        "SELECT tenant_id, phone, chat_id, name, is_super_user, updated_at FROM tenants WHERE updated_at >= ?",
+        (since,)
+    ).fetchall()
+
+def _select_super_phones(conn) -> List[str]:
+    return [row[0] for row in conn.execute("SELECT phone_number FROM super_users").fetchall()]
+
+def _upsert_many(conn, records: List[TenantRecord]):
+    with conn:
+        conn.executemany(
+            "INSERT INTO tenants (tenant_id, phone, chat_id, name, is_super_user, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP) "
+            "ON CONFLICT(tenant_id) DO UPDATE SET phone = excluded.phone, "
+            "chat_id = COALESCE(excluded.chat_id, tenants.chat_id), "
+            "name = COALESCE(excluded.name, tenants.name), "
+            "is_super_user = excluded.is_super_user, updated_at = excluded.updated_at",
+            [
+                (r.tenant_id, r.phone, r.chat_id, r.name, int(r.is_super_user))
+                for r in records
+            ]
+        )
+
+def read_csv(path: str) -> List[TenantRecord]:
+    """Чтение CSV с колонками tenant_id, phone, chat_id, name, is_super_user"""
+    records = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            records.append(TenantRecord(
+                tenant_id=int(row['tenant_id']),
+                phone=normalize_phone(row['phone']),
+                chat_id=(row.get('chat_id') or '').strip() or None,
+                name=(row.get('name') or '').strip() or None,
+                is_super_user=(row.get('is_super_user') or '').strip().lower() in ('1', 'true', 'yes')
+            ))
+    return records
+
+def main(argv=None):
+    """Массовый импорт пользователей: python tenant_registry.py import tenants.csv"""
+    parser = argparse.ArgumentParser(description="Реестр пользователей домофона")
+    sub = parser.add_subparsers(dest='command', required=True)
+    import_parser = sub.add_parser('import', help="Импорт пользователей из CSV")
+    import_parser.add_argument('file')
+    import_parser.add_argument('--db', default=None, help="Путь к базе (по умолчанию DB_PATH)")
+    args = parser.parse_args(argv)
+
+    records = read_csv(args.file)
+    conn = db.connect(args.db)
+    try:
+        _upsert_many(conn, records)
+    finally:
+        conn.close()
+    print(f"Импортировано пользователей: {len(records)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,60 @@
-from quart import Quart, request, jsonify
-from telegram import Bot, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.error import TelegramError
+# Первым: время запуска отсчитывается с импорта startup
+from startup import REPORT as STARTUP, healthz, readyz, warm_up
+from dotenv import load_dotenv
+
+# Переменные окружения загружаются до импорта модулей, которые их читают
+load_dotenv()
+
+from quart import Quart, Response, request, jsonify
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
 from dataclasses import dataclass
-from typing import Optional, Tuple, Dict, Any
+from typing import Optional, Tuple, Dict, Any, List
 import os
-from dotenv import load_dotenv
-from api_client import ApiClient, ApiClientError
+from api_client import ApiClient, ApiClientConfig, TenantInfo
+from cache import SWRCache, TTLCache, SingleFlight
+from tenant_registry import TenantRegistry
+from call_queue import CallDispatcher, CallEvent
+from call_sessions import CallSessionStore, CallSessionConfig
+from telegram_scheduler import TelegramRateLimiter, RateLimiterConfig, Priority
+from media_cache import SnapshotCache, SnapshotCacheConfig, CachedSnapshot
+import metrics
+from logging_setup import log_body, setup_logging
 import logging
 import asyncio
+import time
 from datetime import datetime
 
 # Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+setup_logging()
 logger = logging.getLogger(__name__)
+STARTUP.mark('imports')
 
 @dataclass
 class WebhookConfig:
     telegram_token: str
     api_url: str
     api_token: str
+    # Адрес Bot API (локальный сервер Bot API или заглушка в бенчмарках)
+    telegram_base_url: str = 'https://api.telegram.org/bot'
+    # Соединения с Bot API (у ExtBot по умолчанию одно, и все отправки идут по очереди)
+    telegram_pool_size: int = 256
+    # sync - уведомление отправляется до ответа, async - через очередь с ответом 202
+    delivery_mode: str = 'sync'
+    call_queue_size: int = 1000
+    call_workers: int = 4
+    call_queue_overflow: str = 'reject'
+    call_queue_drain_timeout: float = 10.0
+    # Уведомлять всех жильцов квартиры, а не только пользователя из вызова
+    notify_all_residents: bool = True
+    notify_fanout_limit: int = 10
+    residents_cache_ttl: float = 300.0
+    registry_reload_interval: float = 30.0
+    # Окно подавления повторных доставок одного и того же вызова
+    call_dedupe_ttl: float = 15.0
+    call_dedupe_max_entries: int = 10000
 
     @classmethod
     def from_env(cls):
@@ -29,27 +62,149 @@ class WebhookConfig:
         return cls(
             telegram_token=os.getenv('TELEGRAM_TOKEN', ''),
             api_url=os.getenv('API_URL', ''),
-            api_token=os.getenv('API_TOKEN', '')
+            api_token=os.getenv('API_TOKEN', ''),
+            telegram_base_url=os.getenv('TELEGRAM_BASE_URL', cls.telegram_base_url),
+            telegram_pool_size=int(os.getenv('TG_POOL_SIZE', cls.telegram_pool_size)),
+            delivery_mode=os.getenv('CALL_DELIVERY_MODE', cls.delivery_mode),
+            call_queue_size=int(os.getenv('CALL_QUEUE_SIZE', cls.call_queue_size)),
+            call_workers=int(os.getenv('CALL_WORKERS', cls.call_workers)),
+            call_queue_overflow=os.getenv('CALL_QUEUE_OVERFLOW', cls.call_queue_overflow),
+            call_queue_drain_timeout=float(os.getenv('CALL_QUEUE_DRAIN_TIMEOUT', cls.call_queue_drain_timeout)),
+            notify_all_residents=os.getenv('NOTIFY_ALL_RESIDENTS', 'true').lower() in ('1', 'true', 'yes'),
+            notify_fanout_limit=int(os.getenv('NOTIFY_FANOUT_LIMIT', cls.notify_fanout_limit)),
+            residents_cache_ttl=float(os.getenv('RESIDENTS_CACHE_TTL', cls.residents_cache_ttl)),
+            registry_reload_interval=float(os.getenv('REGISTRY_RELOAD_INTERVAL', cls.registry_reload_interval)),
+            call_dedupe_ttl=float(os.getenv('CALL_DEDUPE_TTL', cls.call_dedupe_ttl)),
+            call_dedupe_max_entries=int(os.getenv('CALL_DEDUPE_MAX_ENTRIES', cls.call_dedupe_max_entries))
         )
 
 class DomophoneWebhookServer:
-    def __init__(self):
+    def __init__(
+        self,
+        bot: Optional[ExtBot] = None,
+        api_client: Optional[ApiClient] = None,
+        registry: Optional[TenantRegistry] = None,
+        snapshot_cache: Optional[SnapshotCache] = None,
+        call_sessions: Optional[CallSessionStore] = None
+    ):
+        """Сервер вебхуков. Компоненты можно передать готовыми, чтобы делить их с ботом"""
         self.config = WebhookConfig.from_env()
         self.app = Quart(__name__)
         self.app.config['PROVIDE_AUTOMATIC_OPTIONS'] = True
-        self.bot = Bot(token=self.config.telegram_token)
-        self.api_client = ApiClient(self.config.api_url, self.config.api_token)
+        self.bot = bot or ExtBot(
+            token=self.config.telegram_token,
+            base_url=self.config.telegram_base_url,
+            request=HTTPXRequest(connection_pool_size=self.config.telegram_pool_size),
+            rate_limiter=TelegramRateLimiter(RateLimiterConfig.from_env())
+        )
+        self.registry = registry or TenantRegistry(reload_interval=self.config.registry_reload_interval)
+        self.api_client = api_client or ApiClient(
+            self.config.api_url,
+            self.config.api_token,
+            ApiClientConfig.from_env(),
+            registry=self.registry
+        )
+        self.snapshot_cache = snapshot_cache or SnapshotCache(self.api_client, SnapshotCacheConfig.from_env())
+        self.call_sessions = call_sessions or CallSessionStore(config=CallSessionConfig.from_env())
+        self._sweeper: Optional[asyncio.Task] = None
+        # Получатели уведомлений по (tenant_id, domofon_id)
+        self._residents_cache = SWRCache(ttl=self.config.residents_cache_ttl, stale_ttl=self.config.residents_cache_ttl * 12)
+        # Ответы на уже обработанные вызовы по (domofon_id, tenant_id, event_id)
+        self._call_results = TTLCache(maxsize=self.config.call_dedupe_max_entries, ttl=self.config.call_dedupe_ttl)
+        self._call_flight = SingleFlight()
+        self.dispatcher: Optional[CallDispatcher] = None
+        if self.config.delivery_mode == 'async':
+            self.dispatcher = CallDispatcher(
+                self._deliver_call,
+                max_size=self.config.call_queue_size,
+                workers=self.config.call_workers,
+                overflow=self.config.call_queue_overflow,
+                drain_timeout=self.config.call_queue_drain_timeout
+            )
+            metrics.register_queue('calls', self.dispatcher.stats)
+        metrics.register_cache('tenants', self.api_client.tenant_cache_stats)
+        metrics.register_cache('api_responses', self.api_client.response_cache_stats)
+        metrics.register_cache('snapshots', self.snapshot_cache.stats)
+        metrics.register_cache('residents', self._residents_cache.stats)
+        metrics.register_cache('call_dedupe', self._call_results.stats)
+        metrics.register_cache('call_sessions', self.call_sessions.stats)
+        self._warmup_task: Optional[asyncio.Task] = None
         self._setup_routes()
 
+    async def startup(self):
+        """Подготовка общих ресурсов перед приёмом запросов"""
+        with STARTUP.phase('registry'):
+            await self.registry.start()
+        await self.api_client.start()
+        with STARTUP.phase('telegram'):
+            await self.bot.initialize()
+        if self.dispatcher:
+            await self.dispatcher.start()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(
+                self.call_sessions.run_sweeper(self._remove_keyboard), name="call-session-sweeper"
+            )
+
+    async def _warm_tenant(self, tenant_id: int):
+        """Загрузка в кэши того, что нужно для доставки вызова пользователю"""
+        await asyncio.gather(
+            self.api_client.check_tenant(tenant_id),
+            self.api_client.resolve_domofons(tenant_id)
+        )
+
+    async def shutdown(self):
+        """Дообработка очереди вызовов и освобождение ресурсов"""
+        # /readyz отвечает 503, чтобы балансировщик перестал присылать запросы
+        STARTUP.set_ready(False)
+        if self._warmup_task is not None:
+            self._warmup_task.cancel()
+            self._warmup_task = None
+        if self.dispatcher:
+            await self.dispatcher.stop()
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        await self.call_sessions.close()
+        await self.bot.shutdown()
+        await self.api_client.close()
+        await self.registry.close()
+
     def _setup_routes(self):
+        # Через обёртки, чтобы в наследниках вызывались переопределённые методы
+        @self.app.before_serving
+        async def startup():
+            await self.startup()
+            # Запросы принимаются сразу (/healthz), трафик - после прогрева (/readyz)
+            self._warmup_task = asyncio.ensure_future(warm_up(self.api_client, self.registry, self._warm_tenant))
+
+        @self.app.after_serving
+        async def shutdown():
+            await self.shutdown()
+
+        @self.app.route('/metrics', methods=['GET'])
+        async def metrics_endpoint():
+            return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+        @self.app.route('/healthz', methods=['GET'])
+        async def healthz_endpoint():
+            status, body = healthz()
+            return jsonify(body), status
+
+        @self.app.route('/readyz', methods=['GET'])
+        async def readyz_endpoint():
+            status, body = readyz()
+            return jsonify(body), status
+
         @self.app.route('/webhook/call', methods=['POST'])
         async def handle_call():
             try:
                 data = await request.get_json()
-                logger.info(f"📥 Получены данные: {data}")
+                log_body(logger, "📥 Тело вызова", data)
 
                 domofon_id = int(data.get('domofon_id'))
                 tenant_id = int(data.get('tenant_id'))
+                logger.info("📥 Вызов домофона %s, tenant_id=%s", domofon_id, tenant_id)
 
                 if not domofon_id or not tenant_id:
                     return jsonify({
@@ -57,37 +212,204 @@ class DomophoneWebhookServer:
                         'status': 'error'
                     }), 400
 
-                user_info = await self.api_client.check_tenant(tenant_id)
-                if not user_info or not user_info.telegram_chat_id:
-                    return jsonify({
-                        'error': 'Пользователь не найден',
-                        'status': 'error'
-                    }), 404
+                event_id = data.get('event_id') or data.get('call_id')
+                event = CallEvent(domofon_id, tenant_id, str(event_id) if event_id else None)
+
+                # Повторная доставка того же вызова получает исходный ответ
+                cached = self._call_results.get(event.dedupe_key)
+                if cached is not None:
+                    logger.info("Повторная доставка вызова домофона %s, ответ из памяти", domofon_id)
+                    metrics.CALLS.labels('duplicate').inc()
+                    body, status = cached
+                    return jsonify(body), status
+
+                body, status = await self._call_flight.do(event.dedupe_key, lambda: self._accept_call(event))
+                return jsonify(body), status
 
-                snapshot_url = await self.api_client.get_camera_snapshot(domofon_id, tenant_id)
-                await self._send_notification(user_info.telegram_chat_id, snapshot_url, domofon_id)
-                
-                return jsonify({
-                    'success': True,
-                    'status': 'success',
-                    'message': 'Уведомление успешно отправлено'
-                })
-                
             except Exception as e:
-                logger.error(f"❌ Ошибка при обработке вызова: {str(e)}")
+                logger.error("❌ Ошибка при обработке вызова: %s", e)
+                metrics.CALLS.labels('error').inc()
                 return jsonify({
                     'error': str(e),
                     'status': 'error'
                 }), 500
 
-    async def _send_notification(self, chat_id: str, snapshot_url: Optional[str], domofon_id: int):
-        """Отправка уведомления в Telegram"""
+    async def _accept_call(self, event: CallEvent) -> Tuple[Dict[str, Any], int]:
+        """Обработка вызова (сразу или через очередь); успешный ответ запоминается для повторов"""
+        if self.dispatcher:
+            if not await self.dispatcher.submit(event):
+                # Не запоминаем: повтор после разгрузки очереди должен пройти
+                metrics.CALLS.labels('rejected').inc()
+                return {
+                    'error': 'Очередь вызовов переполнена',
+                    'status': 'error'
+                }, 503
+            result = {
+                'success': True,
+                'status': 'accepted',
+                'message': 'Вызов принят в обработку'
+            }, 202
+        elif not await self._deliver_call(event):
+            result = {
+                'error': 'Пользователь не найден',
+                'status': 'error'
+            }, 404
+        else:
+            result = {
+                'success': True,
+                'status': 'success',
+                'message': 'Уведомление успешно отправлено'
+            }, 200
+
+        metrics.CALLS.labels(result[0]['status']).inc()
+        # Ошибку не запоминаем: повтор вызова должен снова попробовать доставить уведомление
+        if result[1] in (200, 202):
+            self._call_results.set(event.dedupe_key, result)
+        return result
+
+    async def _deliver_call(self, event: CallEvent) -> bool:
+        """Поиск получателей и снимка (параллельно) и рассылка уведомления.
+
+        False, если получателей нет. Если не доставлено ни одно уведомление,
+        выбрасывается ошибка первой неудачной отправки.
+        """
+        recipients, snapshot, session_id = await asyncio.gather(
+            self._resolve_recipients(event),
+            self._fetch_snapshot(event.domofon_id, event.tenant_id),
+            self._create_session(event)
+        )
+        if not recipients:
+            logger.warning("Пользователь %s не найден, уведомление не отправлено", event.tenant_id)
+            return False
+
+        semaphore = asyncio.Semaphore(self.config.notify_fanout_limit)
+
+        sent = []
+        errors = []
+
+        async def notify(recipient: TenantInfo) -> bool:
+            async with semaphore:
+                try:
+                    message = await self._send_notification(
+                        recipient.telegram_chat_id, snapshot, event.domofon_id, session_id
+                    )
+                    metrics.RING_TO_NOTIFICATION.observe(time.monotonic() - event.received_at)
+                    if message is not None:
+                        sent.append((recipient.telegram_chat_id, message.message_id))
+                    return True
+                except Exception as e:
+                    # Ошибка одного получателя не мешает остальным
+                    logger.error(
+                        "❌ Не удалось отправить уведомление о вызове домофона %s в чат %s: %s",
+                        event.domofon_id, recipient.telegram_chat_id, e
+                    )
+                    errors.append(e)
+                    return False
+
+        results = await asyncio.gather(*(notify(recipient) for recipient in recipients))
+        if session_id:
+            try:
+                await self.call_sessions.add_messages(session_id, sent)
+            except Exception as e:
+                logger.error("Не удалось сохранить уведомления вызова %s: %s", session_id, e)
+        delivered = sum(results)
+        if not delivered:
+            raise errors[0]
+        if delivered < len(recipients):
+            logger.warning("Вызов домофона %s: доставлено %s из %s", event.domofon_id, delivered, len(recipients))
+        return True
+
+    async def _resolve_recipients(self, event: CallEvent) -> List[TenantInfo]:
+        """Пользователь из вызова и, если включено, остальные жильцы квартиры"""
+        if not self.config.notify_all_residents:
+            caller = await self.api_client.check_tenant(event.tenant_id)
+            return [caller] if caller and caller.telegram_chat_id else []
+
+        caller, residents = await asyncio.gather(
+            self.api_client.check_tenant(event.tenant_id),
+            self._residents_cache.get(
+                (event.tenant_id, event.domofon_id),
+                lambda: self._load_residents(event)
+            ),
+            return_exceptions=True
+        )
+        if isinstance(caller, BaseException):
+            caller = None
+        if isinstance(residents, BaseException):
+            logger.warning("Не удалось получить жильцов для вызова домофона %s: %s", event.domofon_id, residents)
+            residents = []
+
+        recipients = {}
+        for info in ([caller] if caller else []) + residents:
+            if info.telegram_chat_id and info.telegram_chat_id not in recipients:
+                recipients[info.telegram_chat_id] = info
+        return list(recipients.values())
+
+    async def _load_residents(self, event: CallEvent) -> List[TenantInfo]:
+        """Жильцы квартиры, чей chat id известен реестру (поиск по телефону)"""
+        residents = await self.api_client.get_apartment_residents(event.domofon_id, event.tenant_id)
+        infos = []
+        for resident in residents:
+            record = self.registry.get_by_phone(resident.phone)
+            if record and record.chat_id:
+                infos.append(TenantInfo(
+                    tenant_id=record.tenant_id,
+                    name=record.name or resident.name,
+                    telegram_chat_id=record.chat_id,
+                    is_super_user=record.is_super_user
+                ))
+        return infos
+
+    async def _create_session(self, event: CallEvent) -> Optional[str]:
+        """Сессия вызова для кнопок; без неё кнопки работают по id домофона, как раньше"""
+        try:
+            return (await self.call_sessions.create(event.domofon_id, event.tenant_id)).session_id
+        except Exception as e:
+            logger.error("Не удалось создать сессию вызова домофона %s: %s", event.domofon_id, e)
+            return None
+
+    async def _remove_keyboard(self, chat_id: str, message_id: int):
+        """Снятие кнопок с уведомления о завершённом вызове.
+
+        Удалённое сообщение, кнопки, уже снятые ботом, или заблокированный
+        бот считаются сделанным; остальные ошибки - повод повторить позже.
+        """
+        try:
+            await self.bot.edit_message_reply_markup(
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=None,
+                rate_limit_args=Priority.INFO
+            )
+        except (BadRequest, Forbidden) as e:
+            logger.debug("Кнопки уведомления %s в чате %s не сняты: %s", message_id, chat_id, e)
+
+    async def _fetch_snapshot(self, domofon_id: int, tenant_id: int) -> Optional[CachedSnapshot]:
+        """Снимок с камеры для уведомления; при ошибке уведомление уходит без снимка"""
+        try:
+            return await self.snapshot_cache.prepare(domofon_id, tenant_id)
+        except Exception as e:
+            logger.error("Ошибка при получении снимка: %s", e)
+            return None
+
+    async def _send_notification(
+        self,
+        chat_id: str,
+        snapshot: Optional[CachedSnapshot],
+        domofon_id: int,
+        session_id: Optional[str] = None
+    ):
+        """Отправка уведомления в Telegram; возвращает отправленное сообщение"""
+        if session_id:
+            open_data, ignore_data = f"callopen_{session_id}", f"callignore_{session_id}"
+        else:
+            open_data, ignore_data = f"open_{domofon_id}", f"ignore_{domofon_id}"
         keyboard = InlineKeyboardMarkup([
             [
-                InlineKeyboardButton("🔓 Открыть дверь", callback_data=f"open_{domofon_id}"),
+                InlineKeyboardButton("🔓 Открыть дверь", callback_data=open_data),
             ],
             [
-                InlineKeyboardButton("⛔️ Не открывать", callback_data=f"ignore_{domofon_id}")
+                InlineKeyboardButton("⛔️ Не открывать", callback_data=ignore_data)
             ]
         ])
         
@@ -101,28 +423,30 @@ class DomophoneWebhookServer:
         )
         
         try:
-            if snapshot_url:
-                await self.bot.send_photo(
+            if snapshot:
+                return await self.snapshot_cache.send(domofon_id, snapshot, lambda photo: self.bot.send_photo(
                     chat_id=chat_id,
-                    photo=snapshot_url,
+                    photo=photo,
                     caption=notification_text,
                     parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
+                    reply_markup=keyboard,
+                    rate_limit_args=Priority.CALL
+                ))
             else:
-                await self.bot.send_message(
+                return await self.bot.send_message(
                     chat_id=chat_id,
                     text=notification_text + "\n\n⚠️ _Снимок с камеры недоступен_",
                     parse_mode='Markdown',
-                    reply_markup=keyboard
+                    reply_markup=keyboard,
+                    rate_limit_args=Priority.CALL
                 )
         except Exception as e:
-            logger.error(f"Ошибка отправки уведомления: {str(e)}")
+            logger.error("Ошибка отправки уведомления: %s", e)
             raise
 
     def run(self, host='0.0.0.0', port=5000):
         """Запуск сервера"""
-        logger.info(f"Запуск webhook сервера на http://{host}:{port}")
+        logger.info("Запуск webhook сервера на http://%s:%s", host, port)
         self.app.run(host=host, port=port)
 
 if __name__ == '__main__':